@@ -3,8 +3,29 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 from datetime import datetime
+import hashlib
 import os
+import threading
+import time
 import warnings
+from collections import OrderedDict
+import pyarrow as pa
+import pyarrow.parquet as pq
+try:
+    from openpyxl import Workbook
+    OPENPYXL_AVAILABLE = True
+except ImportError:
+    OPENPYXL_AVAILABLE = False
+from app_utils import write_atomic
+from sales_forecast import MAX_HORIZON, STATSMODELS_AVAILABLE, ForecastManager
+from sales_ingest import SALES_DATA_DIR, cached_parquet_path, ensure_parquet, load_sales_directory, read_partition
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    FileSystemEventHandler = object
+    WATCHDOG_AVAILABLE = False
 warnings.filterwarnings('ignore')  # 屏蔽无关警告
 
 
@@ -86,65 +107,375 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
-# 3. 数据加载（核心修复：Excel读取+时间列容错）
-@st.cache_data(show_spinner="正在加载销售数据...")
-def load_excel_data():
+# 3. 数据加载（目录下所有工作簿并行解析、转存 Parquet 后合并，见 sales_ingest.py）
+@st.cache_resource(show_spinner="正在加载销售数据...")
+def get_sales_store():
     """
-    读取本地Excel文件（supermarket_sales.xlsx）
-    修复点：1. 跳过标题行 2. 时间列格式容错 3. 字段精准映射
+    读取销售数据目录（SALES_DATA_DIR，默认代码所在目录）下的所有Excel工作簿
+    工作簿只在首次或内容变化时用 openpyxl 解析，之后读取按大小/修改时间/哈希缓存的 Parquet；
+    多个工作簿按订单号去重，source_file 列记录来源文件。进程内所有会话共享同一份数据
     """
-    # 确认文件路径（当前代码所在目录）
-    excel_path = "supermarket_sales.xlsx"
-    if not os.path.exists(excel_path):
-        st.error(f"❌ 未找到数据文件：{excel_path}")
-        st.info("💡 请确保Excel文件与代码放在同一目录")
-        return pd.DataFrame()  # 空表兜底，避免崩溃
-
-    # 读取Excel：跳过第一行（"2022年前3个月销售数据"），用第二行做列名
-    df = pd.read_excel(
-        excel_path,
-        engine="openpyxl",  # 匹配你的openpyxl==3.1.5
-        header=1  # 关键：跳过标题行，解决Unnamed列问题
-    )
-
-    # 字段100%映射你的Excel列名（避免KeyError）
-    df_standard = df.rename(columns={
-        "分店": "branch",
-        "城市": "city",
-        "顾客类型": "customer_type",
-        "性别": "gender",
-        "产品类型": "category",
-        "单价": "unit_price",
-        "数量": "quantity",
-        "总价": "revenue",  # 你的"总价"即销售额
-        "日期": "date",
-        "时间": "time",
-        "评分": "rating"
-    })
-
-    # 核心修复：时间列格式容错（解决ValueError）
-    # 步骤1：清理时间列脏数据（空格、特殊字符）
-    df_standard["time"] = df_standard["time"].astype(str).str.strip()  # 去空格
-    df_standard["time"] = df_standard["time"].str.replace(r"[^\d:]", "", regex=True)  # 删特殊字符
-    # 步骤2：转换时间（兼容%H:%M、%H:%M:%S等格式，无效值填0）
-    time_series = pd.to_datetime(
-        df_standard["time"],
-        format="mixed",  # 自动识别常见时间格式（关键修复）
-        errors="coerce"  # 无法识别的时间→NaT
-    )
-    # 步骤3：提取小时，NaT填充为0（避免后续图表报错）
-    df_standard["hour"] = time_series.dt.hour.fillna(0).astype(int)
-
-    # 日期列转换（确保筛选器正常）
-    df_standard["date"] = pd.to_datetime(df_standard["date"], errors="coerce")
-
-    st.success(f"✅ 数据加载成功！共{len(df_standard)}条销售记录")
-    return df_standard
+    return SalesStore(SALES_DATA_DIR)
+
+
+# 3.1 预聚合数据立方体（筛选只需对立方体单元格求和，耗时与原始行数无关）
+CUBE_DIMENSIONS = ["city", "customer_type", "gender", "hour", "category"]
+
+
+# 按日期预聚合的立方体（趋势分析和预测用），日期取到天
+DAILY_DIMENSIONS = ["date", "city", "customer_type", "gender", "category"]
+# 分店钻取用的立方体：筛选维度 + 分店×产品类型×单价区间
+DRILL_LEVELS = ["branch", "category", "price_band"]
+DRILL_DIMENSIONS = ["city", "customer_type", "gender"] + DRILL_LEVELS
+PRICE_BAND_EDGES = [0, 20, 40, 60, 80, 100, np.inf]
+PRICE_BAND_LABELS = ["¥0-20", "¥20-40", "¥40-60", "¥60-80", "¥80-100", "¥100以上"]
+CUBE_MEASURES = ["revenue", "quantity", "rating_sum", "rating_count", "orders"]
+
+
+def _aggregate(df, keys):
+    """按给定维度汇总：销售额之和、数量之和、评分之和、评分条数、订单数"""
+    # sort=False 保留各取值首次出现的顺序，侧边栏选项顺序与原始数据一致
+    return df.groupby(keys, sort=False, dropna=False).agg(
+        revenue=("revenue", "sum"),
+        quantity=("quantity", "sum"),
+        rating_sum=("rating", "sum"),
+        rating_count=("rating", "count"),
+        orders=("revenue", "size"),
+    ).reset_index()
+
+
+def build_sales_cube(df):
+    """按 城市×顾客类型×性别×小时×产品类型 预聚合"""
+    return _aggregate(df, CUBE_DIMENSIONS)
+
+
+def build_daily_cube(df):
+    """按 日期×城市×顾客类型×性别×产品类型 预聚合（不复制明细表，直接用归一化后的日期序列分组）"""
+    keys = [df["date"].dt.normalize()] + [df[column] for column in DAILY_DIMENSIONS[1:]]
+    return _aggregate(df, keys)
+
+
+def build_drill_cube(df):
+    """按 城市×顾客类型×性别×分店×产品类型×单价区间 预聚合"""
+    price_band = pd.cut(df["unit_price"], PRICE_BAND_EDGES, labels=PRICE_BAND_LABELS, right=False)
+    keys = [df[column] for column in DRILL_DIMENSIONS[:-1]] + [price_band.astype(str).rename("price_band")]
+    return _aggregate(df, keys)
+
+
+def merge_cube(cube, delta, sign=1, dimensions=CUBE_DIMENSIONS):
+    """把增量立方体按单元格加到（sign=-1 时减去）现有立方体上，只处理立方体大小的数据"""
+    if cube.empty:
+        return delta.copy() if sign > 0 else cube
+    delta = delta.copy()
+    delta[CUBE_MEASURES] = delta[CUBE_MEASURES] * sign
+    merged = pd.concat([cube, delta], ignore_index=True).groupby(
+        dimensions, sort=False, dropna=False)[CUBE_MEASURES].sum().reset_index()
+    return merged[merged["orders"] > 0].reset_index(drop=True)
+
+
+def slice_cube(cube, selections):
+    """按各维度选中的取值筛选立方体单元格（选中值为 None 的维度不筛选）"""
+    mask = np.ones(len(cube), dtype=bool)
+    for column, values in selections.items():
+        if values is not None:
+            mask &= cube[column].isin(values).to_numpy()
+    return cube[mask]
+
+
+# 3.2 筛选索引（立方体无法回答的查询：取原始行明细、导出等）
+FILTER_COLUMNS = ["city", "customer_type", "gender", "category"]
+
+
+class SalesFilterIndex:
+    """多选筛选的位图索引：各列存为类别代码，每个取值预先计算一个按位压缩的位图；
+    同一筛选内的取值按位或，不同筛选之间按位与，只返回行号，不复制 DataFrame"""
+
+    def __init__(self, df, columns=FILTER_COLUMNS):
+        self.n_rows = len(df)
+        self.codes = {}
+        self.values = {}
+        self.bitmaps = {}
+        for column in columns:
+            codes, uniques = pd.factorize(df[column], sort=False)  # 缺失值代码为 -1
+            self.codes[column] = codes.astype(np.int16 if len(uniques) > 127 else np.int8)
+            self.values[column] = list(uniques)
+            self.bitmaps[column] = {value: np.packbits(codes == code)
+                                    for code, value in enumerate(uniques)}
+
+    def _column_bits(self, column, selected):
+        """一列的筛选位图；选中全部取值时返回 None（该列不参与筛选）"""
+        bitmaps = self.bitmaps[column]
+        selected = [value for value in selected if value in bitmaps]
+        if len(selected) == len(bitmaps):
+            return None
+        bits = np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+        for value in selected:
+            np.bitwise_or(bits, bitmaps[value], out=bits)
+        return bits
+
+    def mask(self, selections):
+        """返回布尔掩码；selections 为 {列名: 选中取值列表}，值为 None 的列不筛选"""
+        result = None
+        for column, selected in selections.items():
+            if selected is None:
+                continue
+            bits = self._column_bits(column, selected)
+            if bits is None:
+                continue
+            result = bits if result is None else np.bitwise_and(result, bits, out=result)
+        if result is None:
+            return np.ones(self.n_rows, dtype=bool)
+        return np.unpackbits(result, count=self.n_rows).view(bool)
+
+    def row_indices(self, selections):
+        """返回满足筛选条件的行号（升序），可直接用于 df.iloc / take"""
+        return np.flatnonzero(self.mask(selections))
+
+
+@st.cache_resource(show_spinner="正在构建筛选索引...", max_entries=2)
+def load_filter_index(_df, data_version):
+    """每个数据版本只构建一次位图索引，各会话共享"""
+    return SalesFilterIndex(_df)
+
+
+# 3.3 实时刷新（监听数据目录，只解析变化的工作簿并增量合并）
+REFRESH_DEBOUNCE_SECONDS = 2.0  # 导出文件可能分多次写入，最后一次变化后再解析
+REFRESH_CHECK_SECONDS = 30  # 打开的页面检查新数据版本的间隔
+
+
+class SalesStore:
+    """进程内共享的销售数据：合并后的明细表、预聚合立方体、按日立方体、分店钻取立方体和数据版本号。
+    明细表和立方体整体替换（不原地修改），读取方通过 snapshot() 拿到一致的一组；
+    changes 记录每个版本涉及的日期，趋势序列据此只重算变化的日期；
+    sources 按合并顺序记录各工作簿的内容哈希（Parquet 缓存文件名），用作跨进程、跨重启的数据内容键"""
+
+    MAX_CHANGES = 100
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        df, paths = load_sales_directory(directory)
+        self.df = df
+        self.cube = build_sales_cube(df) if not df.empty else pd.DataFrame()
+        self.daily = build_daily_cube(df) if not df.empty else pd.DataFrame()
+        self.drill = build_drill_cube(df) if not df.empty else pd.DataFrame()
+        self.changes = []  # [(版本, 涉及的日期集合；None 表示全量重建)]
+        self.version = 0
+        self.workbooks = {os.path.basename(path) for path in paths}
+        self.sources = {os.path.basename(path): os.path.basename(cached_parquet_path(path)) for path in paths}
+        self.last_update = None
+        self.last_error = None
+        self._observer = None
+        self._timers = {}
+
+    def snapshot(self):
+        """返回 (数据版本, 明细表, 立方体)"""
+        with self.lock:
+            return self.version, self.df, self.cube
+
+    def daily_snapshot(self):
+        """返回 (数据版本, 按日立方体)"""
+        with self.lock:
+            return self.version, self.daily
+
+    def drill_snapshot(self):
+        """返回 (数据版本, 分店钻取立方体)"""
+        with self.lock:
+            return self.version, self.drill
+
+    def content_key(self, version):
+        """数据内容键（工作簿名和内容哈希的摘要）；version 已不是当前版本时返回 None"""
+        with self.lock:
+            if version != self.version:
+                return None
+            text = "|".join(f"{name}:{source}" for name, source in self.sources.items())
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+    def changed_dates_since(self, version):
+        """version 之后各版本涉及的日期；无法确定（全量重建或记录已丢弃）时返回 None"""
+        with self.lock:
+            if version < self.version - len(self.changes):
+                return None
+            dates = set()
+            for change_version, change_dates in self.changes:
+                if change_version > version:
+                    if change_dates is None:
+                        return None
+                    dates |= change_dates
+            return dates
+
+    def apply_workbook(self, path):
+        """新增或修改的工作簿：只解析该文件，替换它原有的行并合并到明细表和立方体"""
+        name = os.path.basename(path)
+        parquet_path = ensure_parquet(path)
+        new_rows = read_partition(path, parquet_path).to_pandas()
+        new_rows = new_rows.drop_duplicates(subset="order_id", keep="last", ignore_index=True)
+        with self.lock:
+            df = self.df
+            own_ids = df.loc[df["source_file"] == name, "order_id"] if not df.empty else pd.Series(dtype=object)
+        if (~own_ids.isin(new_rows["order_id"])).any():
+            # 工作簿删掉了部分订单：其他工作簿中可能还有这些订单的旧记录，从 Parquet 缓存重建
+            self.reload(name)
+        else:
+            self._merge(name, new_rows, os.path.basename(parquet_path))
+
+    def remove_workbook(self, path):
+        """被删除的工作簿：它覆盖过的其他工作簿记录需要恢复，从 Parquet 缓存重建"""
+        self.reload(os.path.basename(path))
+
+    def reload(self, name):
+        """重新合并目录下所有工作簿（未变化的工作簿直接读取 Parquet 缓存，不解析 Excel）；
+        重建在锁外进行，期间其他工作簿的增量合并已完成时重新读取目录，不覆盖它的结果"""
+        while True:
+            with self.lock:
+                version = self.version
+            df, paths = load_sales_directory(self.directory)
+            cube = build_sales_cube(df) if not df.empty else pd.DataFrame()
+            daily = build_daily_cube(df) if not df.empty else pd.DataFrame()
+            drill = build_drill_cube(df) if not df.empty else pd.DataFrame()
+            sources = {os.path.basename(path): os.path.basename(cached_parquet_path(path)) for path in paths}
+            with self.lock:
+                if self.version != version:
+                    continue
+                self.df, self.cube, self.daily, self.drill = df, cube, daily, drill
+                self.workbooks = {os.path.basename(path) for path in paths}
+                self.sources = sources
+                self._bump(name, "从缓存重建", None)
+                return
+
+    def _merge(self, name, new_rows, source):
+        with self.lock:
+            df, cube, daily, drill = self.df, self.cube, self.daily, self.drill
+            if df.empty:
+                removed_mask = np.zeros(len(df), dtype=bool)
+            else:
+                # 该工作簿原有的行，以及被新数据覆盖的同订单号记录（与全量加载一样保留较新的工作簿）
+                removed_mask = (df["source_file"] == name).to_numpy()
+                removed_mask |= df["order_id"].isin(new_rows["order_id"]).to_numpy()
+            removed = df[removed_mask]
+            changed_dates = set(new_rows["date"].dt.normalize().dropna())
+            if len(removed):
+                cube = merge_cube(cube, build_sales_cube(removed), sign=-1)
+                daily = merge_cube(daily, build_daily_cube(removed), sign=-1, dimensions=DAILY_DIMENSIONS)
+                drill = merge_cube(drill, build_drill_cube(removed), sign=-1, dimensions=DRILL_DIMENSIONS)
+                changed_dates |= set(removed["date"].dt.normalize().dropna())
+            parts = [df[~removed_mask]] if len(df) else []
+            if len(new_rows):
+                cube = merge_cube(cube, build_sales_cube(new_rows))
+                daily = merge_cube(daily, build_daily_cube(new_rows), dimensions=DAILY_DIMENSIONS)
+                drill = merge_cube(drill, build_drill_cube(new_rows), dimensions=DRILL_DIMENSIONS)
+                parts.append(new_rows)
+            merged = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+            if not merged.empty:
+                merged["source_file"] = merged["source_file"].astype("category")
+
+            self.df, self.cube, self.daily, self.drill = merged, cube, daily, drill
+            self.workbooks.add(name)
+            # 增量合并的工作簿排在最后（与全量加载时按修改时间排序一致）
+            self.sources.pop(name, None)
+            self.sources[name] = source
+            self._bump(name, "增量合并", changed_dates)
+
+    def _bump(self, name, mode, changed_dates):
+        """数据替换后递增版本号并记录本次更新（调用方持有锁）"""
+        self.version += 1
+        self.changes = (self.changes + [(self.version, changed_dates)])[-self.MAX_CHANGES:]
+        self.last_update = {
+            "time": datetime.now().strftime("%H:%M:%S"),
+            "file": name,
+            "mode": mode,
+            "rows": len(self.df),
+        }
+
+    def schedule(self, path, deleted=False):
+        """文件事件去抖：同一文件在 REFRESH_DEBOUNCE_SECONDS 内的多次事件只处理最后一次"""
+        with self.lock:
+            timer = self._timers.pop(path, None)
+            if timer is not None:
+                timer.cancel()
+            timer = threading.Timer(REFRESH_DEBOUNCE_SECONDS, self._refresh, args=(path, deleted))
+            timer.daemon = True
+            self._timers[path] = timer
+        timer.start()
+
+    def _refresh(self, path, deleted):
+        with self.lock:
+            self._timers.pop(path, None)
+        try:
+            if deleted or not os.path.exists(path):
+                self.remove_workbook(path)
+            else:
+                self.apply_workbook(path)
+            self.last_error = None
+        except Exception as e:  # 文件仍在写入或格式错误：保留现有数据，等待下一次变化
+            self.last_error = f"{os.path.basename(path)}：{e}"
+
+    def start_watching(self):
+        """启动目录监听（每个进程只启动一次）"""
+        if not WATCHDOG_AVAILABLE:
+            return
+        # 多个会话可能同时打开实时刷新开关，检查和启动都在锁内进行
+        with self.lock:
+            if self._observer is not None:
+                return
+            observer = Observer()
+            observer.schedule(WorkbookEventHandler(self), self.directory, recursive=False)
+            observer.daemon = True
+            observer.start()
+            self._observer = observer
+
+    @property
+    def watching(self):
+        return self._observer is not None
+
+
+def is_sales_workbook(path):
+    name = os.path.basename(path)
+    return name.endswith(".xlsx") and not name.startswith("~$")
+
+
+class WorkbookEventHandler(FileSystemEventHandler):
+    """把工作簿的新增/修改/删除/改名事件转给 SalesStore"""
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+
+    def on_created(self, event):
+        if not event.is_directory and is_sales_workbook(event.src_path):
+            self.store.schedule(event.src_path)
+
+    on_modified = on_created
+
+    def on_deleted(self, event):
+        if not event.is_directory and is_sales_workbook(event.src_path):
+            self.store.schedule(event.src_path, deleted=True)
+
+    def on_moved(self, event):
+        if event.is_directory:
+            return
+        if is_sales_workbook(event.src_path):
+            self.store.schedule(event.src_path, deleted=True)
+        if is_sales_workbook(event.dest_path):
+            self.store.schedule(event.dest_path)
+
+
+@st.fragment(run_every=REFRESH_CHECK_SECONDS)
+def watch_data_version(data_version):
+    """定时检查数据版本，有新数据时整页重跑"""
+    if get_sales_store().version != data_version:
+        st.rerun()
 
 
 # 4. KPI指标生成（匹配效果图的3个核心指标）
-def generate_kpi(filtered_df):
-    """生成：总销售额、顾客平均评分、每单平均销售额"""
+def generate_kpi(cube_slice):
+    """生成：总销售额、顾客平均评分、每单平均销售额（由选中的立方体单元格汇总）"""
+    total_revenue = cube_slice["revenue"].sum()
+    orders = cube_slice["orders"].sum()
+    rating_count = cube_slice["rating_count"].sum()
+    avg_rating = cube_slice["rating_sum"].sum() / rating_count if rating_count else np.nan
+    avg_order = total_revenue / orders if orders else np.nan
+
     # 分3列展示KPI
     col1, col2, col3 = st.columns(3, gap="medium")
 
@@ -152,7 +483,6 @@ def generate_kpi(filtered_df):
     with col1:
         st.markdown('<div class="metric-card">', unsafe_allow_html=True)
         st.markdown('<div class="metric-title">总销售额：</div>', unsafe_allow_html=True)
-        total_revenue = filtered_df["revenue"].sum()
         st.markdown(f'<div class="metric-value">RMB ¥ {total_revenue:,.0f}</div>', unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
 
@@ -160,7 +490,6 @@ def generate_kpi(filtered_df):
     with col2:
         st.markdown('<div class="metric-card">', unsafe_allow_html=True)
         st.markdown('<div class="metric-title">顾客评分的平均值：</div>', unsafe_allow_html=True)
-        avg_rating = filtered_df["rating"].mean()
         st.markdown(f'<div class="metric-value">{avg_rating:.1f} ⭐</div>', unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
 
@@ -168,14 +497,13 @@ def generate_kpi(filtered_df):
     with col3:
         st.markdown('<div class="metric-card">', unsafe_allow_html=True)
         st.markdown('<div class="metric-title">每单的平均销售额：</div>', unsafe_allow_html=True)
-        avg_order = filtered_df["revenue"].mean()
         st.markdown(f'<div class="metric-value">RMB ¥ {avg_order:.2f}</div>', unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
 
 
 # 5. 图表生成（复刻效果图的2个核心图表）
-def generate_charts(filtered_df):
-    """生成：按小时销售额、按产品类型销售额"""
+def generate_charts(cube_slice):
+    """生成：按小时销售额、按产品类型销售额（由选中的立方体单元格汇总）"""
     # 分2列展示图表
     col1, col2 = st.columns(2, gap="medium")
 
@@ -184,7 +512,7 @@ def generate_charts(filtered_df):
         st.markdown('<div class="chart-container">', unsafe_allow_html=True)
         st.subheader("📊 按小时数划分的销售额")
         # 按小时聚合销售额
-        hour_sales = filtered_df.groupby("hour")["revenue"].sum().reset_index()
+        hour_sales = cube_slice.groupby("hour")["revenue"].sum().reset_index()
         # 绘制柱状图（匹配效果图风格）
         st.bar_chart(
             hour_sales,
@@ -200,7 +528,7 @@ def generate_charts(filtered_df):
         st.markdown('<div class="chart-container">', unsafe_allow_html=True)
         st.subheader("📊 按产品类型划分的销售额")
         # 按产品类型聚合销售额（降序排列）
-        category_sales = filtered_df.groupby("category")["revenue"].sum().sort_values(ascending=False).reset_index()
+        category_sales = cube_slice.groupby("category")["revenue"].sum().sort_values(ascending=False).reset_index()
         # 绘制柱状图
         st.bar_chart(
             category_sales,
@@ -212,56 +540,481 @@ def generate_charts(filtered_df):
         st.markdown('</div>', unsafe_allow_html=True)
 
 
+# 5.1 趋势分析（按日序列按筛选条件缓存，新数据只重算涉及的日期）
+TREND_FREQUENCIES = {"按日": "D", "按周": "W-MON", "按月": "MS"}
+SERIES_CACHE_SIZE = 64
+
+
+def compute_daily_series(daily_cube):
+    """按日立方体 → 以日期为有序索引的每日汇总（销售额、评分之和、评分条数、订单数）"""
+    series = daily_cube.dropna(subset=["date"]).groupby("date")[CUBE_MEASURES].sum()
+    return series.sort_index()
+
+
+@st.cache_resource
+def get_series_cache():
+    """进程内共享的每日序列缓存：{筛选条件: (数据版本, 每日序列)}，按最近使用淘汰"""
+    return {"lock": threading.Lock(), "entries": OrderedDict()}
+
+
+def get_daily_series(store, selections):
+    """某个筛选条件下的每日序列：缓存命中且数据版本一致时直接返回；
+    数据有更新时只对变化的日期重新汇总并替换，历史日期沿用缓存结果"""
+    data_version, daily = store.daily_snapshot()
+    key = selection_key(selections)
+    cache = get_series_cache()
+    with cache["lock"]:
+        cached = cache["entries"].get(key)
+
+    if cached is not None and cached[0] == data_version:
+        series = cached[1]
+    else:
+        selected = slice_cube(daily, selections)
+        changed_dates = store.changed_dates_since(cached[0]) if cached is not None else None
+        if changed_dates is None:
+            series = compute_daily_series(selected)
+        else:
+            changed = pd.DatetimeIndex(sorted(changed_dates))
+            update = compute_daily_series(selected[selected["date"].isin(changed)])
+            series = pd.concat([cached[1].drop(changed, errors="ignore"), update]).sort_index()
+
+    with cache["lock"]:
+        cache["entries"][key] = (data_version, series)
+        cache["entries"].move_to_end(key)
+        while len(cache["entries"]) > SERIES_CACHE_SIZE:
+            cache["entries"].popitem(last=False)
+    return series
+
+
+def resample_series(daily_series, freq):
+    """把每日序列重采样为日/周/月：销售额、订单数、平均评分；按日时附带 7/28 天滚动窗口"""
+    # 补齐没有销售的日期，滚动窗口按自然日计算
+    daily = daily_series.asfreq("D", fill_value=0) if len(daily_series) else daily_series
+    # 周/月以区间起始日期作为标签（周一、月初）
+    frame = daily.resample(freq, label="left", closed="left").sum() if freq != "D" else daily
+    result = pd.DataFrame({
+        "销售额": frame["revenue"],
+        "订单数": frame["orders"],
+        "平均评分": frame["rating_sum"] / frame["rating_count"].replace(0, np.nan),
+    })
+    if freq == "D":
+        for window in (7, 28):
+            rolling = daily[CUBE_MEASURES].rolling(f"{window}D").sum()
+            result[f"销售额（{window}日滚动）"] = rolling["revenue"]
+            result[f"订单数（{window}日滚动）"] = rolling["orders"]
+            result[f"平均评分（{window}日滚动）"] = rolling["rating_sum"] / rolling["rating_count"].replace(0, np.nan)
+    return result
+
+
+def show_trend_page(store, selections):
+    """趋势分析页面：销售额、订单数、平均评分随日期变化"""
+    st.subheader("📈 销售趋势")
+    granularity = st.radio("时间粒度：", list(TREND_FREQUENCIES), horizontal=True)
+    freq = TREND_FREQUENCIES[granularity]
+    trend = resample_series(get_daily_series(store, selections), freq)
+    if trend.empty:
+        st.info("当前筛选条件下没有带日期的销售记录")
+        return
+
+    revenue_columns = [column for column in trend.columns if column.startswith("销售额")]
+    order_columns = [column for column in trend.columns if column.startswith("订单数")]
+    rating_columns = [column for column in trend.columns if column.startswith("平均评分")]
+    st.markdown("**销售额**")
+    st.line_chart(trend[revenue_columns])
+    col1, col2 = st.columns(2, gap="medium")
+    with col1:
+        st.markdown("**订单数**")
+        st.line_chart(trend[order_columns])
+    with col2:
+        st.markdown("**平均评分**")
+        st.line_chart(trend[rating_columns])
+    with st.expander("📋 趋势数据"):
+        st.dataframe(trend.round(2))
+
+
+# 5.2 销售预测（每个 城市×产品类型 一个 Holt-Winters 模型，后台进程池拟合，见 sales_forecast.py）
+FORECAST_CHECK_SECONDS = 3  # 有序列在拟合时，页面检查拟合完成的间隔
+FORECAST_HISTORY_DAYS = 60  # 图中显示的历史天数
+
+
+@st.cache_resource
+def get_forecast_manager():
+    """进程内共享的拟合管理器（进程池和结果缓存）"""
+    return ForecastManager()
+
+
+@st.cache_resource(max_entries=2)
+def build_forecast_series(_daily, data_version):
+    """每个数据版本构建一次各 城市×产品类型 的日销售额序列：{(城市, 产品类型): 按日索引的 Series}。
+    每个序列只覆盖自己的首末销售日期（中间无销售的日期补0），
+    不对齐到全局日期范围，其他序列新增日期时不会让它多出末尾的0而被重新拟合"""
+    daily = _daily.dropna(subset=["date"])
+    totals = daily.groupby(["city", "category", "date"], observed=True)["revenue"].sum()
+    return {key: group.droplevel(["city", "category"]).asfreq("D", fill_value=0)
+            for key, group in totals.groupby(level=["city", "category"], observed=True)}
+
+
+@st.fragment(run_every=FORECAST_CHECK_SECONDS)
+def watch_forecast_progress():
+    """后台拟合全部完成后整页重跑，显示新结果"""
+    if get_forecast_manager().pending_count == 0:
+        st.rerun()
+
+
+def show_forecast_page(store, cube):
+    """销售预测页面：选择城市和产品类型，显示历史日销售额和预测值"""
+    st.subheader("🔮 日销售额预测")
+    if not STATSMODELS_AVAILABLE:
+        st.warning("未安装 statsmodels，无法使用销售预测")
+        return
+    st.caption("按城市×产品类型分别拟合 Holt-Winters 模型（使用全部顾客数据，不受左侧筛选影响）；"
+               "只有数据变化的序列会重新拟合")
+
+    data_version, daily = store.daily_snapshot()
+    series_map = build_forecast_series(daily, data_version)
+    if not series_map:
+        st.info("没有带日期的销售记录")
+        return
+    # 一次提交全部序列，切换城市/产品类型时无需等待
+    results = get_forecast_manager().request(series_map)
+
+    col1, col2, col3 = st.columns(3, gap="medium")
+    with col1:
+        city = st.selectbox("城市：", [c for c in cube["city"].unique() if any(k[0] == c for k in series_map)])
+    with col2:
+        category = st.selectbox("产品类型：", [c for c in cube["category"].unique() if (city, c) in series_map])
+    with col3:
+        horizon = st.slider("预测天数：", 7, MAX_HORIZON, 28, 7)
+
+    # None 表示仍在拟合；拟合失败的序列带 error，不再等待
+    pending = sum(result is None for result in results.values())
+    failed = sum(result is not None and "error" in result for result in results.values())
+    if pending:
+        st.info(f"⏳ 正在后台拟合 {pending} 个序列，完成后自动刷新")
+        watch_forecast_progress()
+    if failed:
+        st.warning(f"{failed} 个序列拟合失败，无法给出预测")
+
+    result = results.get((city, category))
+    if result is not None and "error" in result:
+        st.error(f"❌ {city} · {category} 拟合失败：{result['error']}")
+        result = None
+    history = series_map[(city, category)].iloc[-FORECAST_HISTORY_DAYS:]
+    chart = pd.DataFrame({"实际销售额": history})
+    if result is not None:
+        forecast_index = pd.date_range(result["forecast_start"], periods=horizon, freq="D")
+        forecast = pd.Series(result["forecast"][:horizon], index=forecast_index)
+        chart = chart.reindex(chart.index.union(forecast_index))
+        chart["预测销售额"] = forecast
+    st.line_chart(chart)
+
+    if result is not None:
+        col1, col2 = st.columns(2, gap="medium")
+        with col1:
+            st.metric(f"未来{horizon}天预测销售额", f"RMB ¥ {sum(result['forecast'][:horizon]):,.0f}")
+            st.caption(f"模型：{result['model']}，SSE {result['sse']:,.0f}")
+        with col2:
+            st.dataframe(pd.Series(result["params"], name="参数值", dtype=float).round(4), use_container_width=True)
+
+
+# 5.3 数据导出（按位图索引给出的行号分块写出，不生成筛选后的 DataFrame 副本）
+EXPORT_FORMATS = {"CSV": "csv", "Parquet": "parquet", "Excel": "xlsx"}
+EXPORT_CHUNK_ROWS = 100_000
+EXPORT_TTL_SECONDS = 3600  # 导出文件保留时间
+XLSX_MAX_ROWS = 1_048_575  # Excel 单个工作表的最大数据行数（不含表头）
+# 开启静态文件服务时导出到 static/ 下，由服务器直接从磁盘发送，不经过脚本内存
+EXPORT_STATIC_DIR = os.path.join("static", "exports")
+EXPORT_DIR = os.path.join("artifacts", "sales_exports")
+
+
+def iter_export_chunks(df, row_indices, chunk_size=EXPORT_CHUNK_ROWS):
+    """按行号分块取出明细，每次只物化 chunk_size 行"""
+    for start in range(0, len(row_indices), chunk_size):
+        yield df.take(row_indices[start:start + chunk_size])
+
+
+def write_csv_export(df, row_indices, target):
+    # utf-8-sig：Excel 直接打开时中文不乱码
+    with open(target, "w", encoding="utf-8-sig", newline="") as f:
+        df.iloc[:0].to_csv(f, index=False)
+        for chunk in iter_export_chunks(df, row_indices):
+            chunk.to_csv(f, header=False, index=False)
+
+
+def write_parquet_export(df, row_indices, target):
+    """Arrow 记录批次逐块写入同一个 Parquet 文件"""
+    writer = None
+    try:
+        for chunk in iter_export_chunks(df, row_indices):
+            batch = pa.RecordBatch.from_pandas(chunk, schema=writer.schema if writer else None, preserve_index=False)
+            if writer is None:
+                # 用第一块推断表结构（空表无法推断字符串列类型）
+                writer = pq.ParquetWriter(target, batch.schema)
+            writer.write_batch(batch)
+        if writer is None:
+            pq.write_table(pa.Table.from_pandas(df.iloc[:0], preserve_index=False), target)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def write_xlsx_export(df, row_indices, target):
+    """openpyxl 只写（流式）模式逐行写出，内存占用不随行数增长"""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("销售数据")
+    sheet.append(list(df.columns))
+    for chunk in iter_export_chunks(df, row_indices):
+        # 缺失值写为空单元格
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        for row in chunk.itertuples(index=False, name=None):
+            sheet.append(row)
+    workbook.save(target)
+
+
+EXPORT_WRITERS = {"csv": write_csv_export, "parquet": write_parquet_export, "xlsx": write_xlsx_export}
+
+
+def export_path(content_key, selections, fmt, directory):
+    """同一数据内容、筛选条件和格式的导出文件只生成一次（各会话、各进程共享，重启后仍有效）；
+    content_key 来自工作簿内容哈希，不用进程内的数据版本号"""
+    key = repr((content_key, sorted((column, sorted(map(str, values))) for column, values in selections.items())))
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(directory, f"sales_{digest}.{fmt}")
+
+
+def remove_stale_exports(directory):
+    """删除超过保留时间的导出文件"""
+    if not os.path.isdir(directory):
+        return
+    now = time.time()
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and now - os.path.getmtime(path) > EXPORT_TTL_SECONDS:
+            os.remove(path)
+
+
+def build_export(df, row_indices, fmt, target):
+    """写出导出文件（原子替换，避免其他会话拿到写了一半的文件）"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    remove_stale_exports(os.path.dirname(target))
+    return write_atomic(target, lambda tmp_path: EXPORT_WRITERS[fmt](df, row_indices, tmp_path))
+
+
+def show_export_panel(df, data_version, content_key, selections):
+    """导出筛选后的明细数据"""
+    with st.expander("⬇️ 导出筛选后的数据"):
+        if content_key is None:
+            st.info("数据刚刚更新，请刷新页面后再导出")
+            return
+        label = st.radio("导出格式：", list(EXPORT_FORMATS), horizontal=True)
+        fmt = EXPORT_FORMATS[label]
+        row_indices = load_filter_index(df, data_version).row_indices(selections)
+        if fmt == "xlsx" and (not OPENPYXL_AVAILABLE or len(row_indices) > XLSX_MAX_ROWS):
+            st.warning("Excel 导出需要 openpyxl，且单个工作表最多 1048575 行，请改用 CSV 或 Parquet")
+            return
+        download_name = f"销售数据_筛选结果.{fmt}"
+
+        if st.get_option("server.enableStaticServing"):
+            target = export_path(content_key, selections, fmt, EXPORT_STATIC_DIR)
+            if not os.path.exists(target) and st.button(f"生成 {label} 文件（{len(row_indices)} 条）"):
+                with st.spinner("正在分块写出导出文件..."):
+                    build_export(df, row_indices, fmt, target)
+            if os.path.exists(target):
+                url = f"app/static/exports/{os.path.basename(target)}"
+                size = os.path.getsize(target)
+                size_text = f"{size / 1024 ** 2:.1f} MB" if size >= 1024 ** 2 else f"{size / 1024:.0f} KB"
+                st.markdown(f'<a href="{url}" download="{download_name}">📥 下载 {download_name}</a>（{size_text}）',
+                            unsafe_allow_html=True)
+        else:
+            # 未开启静态文件服务：点击下载时才生成文件
+            target = export_path(content_key, selections, fmt, EXPORT_DIR)
+
+            def open_export():
+                if not os.path.exists(target):
+                    build_export(df, row_indices, fmt, target)
+                with open(target, "rb") as f:
+                    return f.read()
+            st.download_button(f"📥 下载 {label} 文件（{len(row_indices)} 条）", data=open_export,
+                               file_name=download_name)
+
+
+# 5.4 分店钻取（分店 → 产品类型 → 单价区间，逐级由下一级的缓存结果汇总）
+DRILL_LEVEL_NAMES = {"branch": "分店", "category": "产品类型", "price_band": "单价区间"}
+
+
+def selection_key(selections):
+    """把筛选条件转换为可哈希的缓存键"""
+    return tuple((column, tuple(sorted(map(str, values)))) for column, values in selections.items())
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def drill_table(_drill_cube, data_version, key, depth):
+    """某个筛选条件下按前 depth 个钻取层级汇总的表：
+    最细一级由钻取立方体切片得到，其余各级都由下一级的缓存结果再汇总，不扫描原始行"""
+    if depth == len(DRILL_LEVELS):
+        selected = slice_cube(_drill_cube, {column: list(values) for column, values in key})
+        return selected.groupby(DRILL_LEVELS, sort=False)[CUBE_MEASURES].sum().reset_index()
+    finer = drill_table(_drill_cube, data_version, key, depth + 1)
+    return finer.groupby(DRILL_LEVELS[:depth], sort=False)[CUBE_MEASURES].sum().reset_index()
+
+
+def format_drill_table(table, level):
+    """汇总表 → 展示用的数量/销售额/评分表（按销售额降序；单价区间按区间顺序）"""
+    result = pd.DataFrame({
+        DRILL_LEVEL_NAMES[level]: table[level],
+        "数量": table["quantity"],
+        "销售额": table["revenue"].round(2),
+        "订单数": table["orders"],
+        "平均评分": (table["rating_sum"] / table["rating_count"].replace(0, np.nan)).round(2),
+        "销售额占比": (table["revenue"] / table["revenue"].sum()).round(4),
+    })
+    if level == "price_band":
+        order = pd.Categorical(result[DRILL_LEVEL_NAMES[level]], PRICE_BAND_LABELS, ordered=True)
+        return result.iloc[np.argsort(order.codes, kind="stable")]
+    return result.sort_values("销售额", ascending=False)
+
+
+def show_drill_page(store, selections):
+    """分店钻取页面：逐级选择分店和产品类型，查看数量/销售额/评分"""
+    st.subheader("🔎 分店与商品钻取")
+    data_version, drill = store.drill_snapshot()
+    key = selection_key(selections)
+
+    # 第1级：各分店
+    branches = drill_table(drill, data_version, key, 1)
+    if branches.empty:
+        st.info("当前筛选条件下没有销售记录")
+        return
+    by_category = drill_table(drill, data_version, key, 2)
+    col1, col2 = st.columns(2, gap="medium")
+    with col1:
+        st.markdown("**各分店汇总**")
+        st.dataframe(format_drill_table(branches, "branch"), hide_index=True, use_container_width=True)
+    with col2:
+        st.markdown("**分店 × 产品类型 销售额**")
+        st.dataframe(by_category.pivot_table(index="branch", columns="category", values="revenue",
+                                             aggfunc="sum", fill_value=0).round(2), use_container_width=True)
+
+    branch = st.selectbox("钻取分店：", ["（不钻取）"] + sorted(branches["branch"].astype(str)))
+    if branch == "（不钻取）":
+        return
+
+    # 第2级：该分店的各产品类型（由第2级缓存表筛选得到）
+    categories = by_category[by_category["branch"].astype(str) == branch]
+    by_band = drill_table(drill, data_version, key, 3)
+    by_band = by_band[by_band["branch"].astype(str) == branch]
+    col1, col2 = st.columns(2, gap="medium")
+    with col1:
+        st.markdown(f"**{branch} · 各产品类型**")
+        st.dataframe(format_drill_table(categories, "category"), hide_index=True, use_container_width=True)
+    with col2:
+        st.markdown(f"**{branch} · 产品类型 × 单价区间 数量**")
+        pivot = by_band.pivot_table(index="category", columns="price_band", values="quantity",
+                                    aggfunc="sum", fill_value=0)
+        st.dataframe(pivot.reindex(columns=[c for c in PRICE_BAND_LABELS if c in pivot.columns]),
+                     use_container_width=True)
+
+    category = st.selectbox("钻取产品类型：", ["（不钻取）"] + sorted(categories["category"].astype(str)))
+    if category == "（不钻取）":
+        return
+
+    # 第3级：该分店该产品类型的各单价区间
+    bands = by_band[by_band["category"].astype(str) == category]
+    st.markdown(f"**{branch} · {category} · 各单价区间**")
+    band_table = format_drill_table(bands, "price_band")
+    st.dataframe(band_table, hide_index=True, use_container_width=True)
+    st.bar_chart(band_table, x="单价区间", y="销售额", color="#007bff", use_container_width=True)
+
+
 # 6. 主函数（整合所有功能+侧边栏筛选）
 def main():
     # 标题
     st.markdown('<h1 class="main-title">📊 销售仪表板</h1>', unsafe_allow_html=True)
 
-    # 加载数据
-    df = load_excel_data()
+    # 加载数据（明细表和预聚合立方体来自同一数据版本）
+    store = get_sales_store()
+    data_version, df, cube = store.snapshot()
     if df.empty:
+        st.error(f"❌ 未在 {os.path.abspath(SALES_DATA_DIR)} 找到销售数据工作簿（.xlsx）")
+        st.info("💡 请确保Excel文件与代码放在同一目录，或设置环境变量 SALES_DATA_DIR")
         return  # 数据为空时终止运行
-
-    # 筛选后的数据副本
-    df_filtered = df.copy()
+    st.success(f"✅ 数据加载成功！共{len(df)}条销售记录（来自{len(store.workbooks)}个工作簿，已按订单号去重）")
+
+    # 实时刷新：监听数据目录，新增/修改的工作簿增量合并，打开的页面在下次重跑时使用新版本
+    if WATCHDOG_AVAILABLE:
+        live_refresh = st.sidebar.toggle("🔄 实时刷新", value=store.watching,
+                                         help="监听数据目录，新的导出文件放入后自动合并")
+        if live_refresh:
+            store.start_watching()
+            watch_data_version(data_version)
+        if store.last_update:
+            update = store.last_update
+            st.sidebar.caption(f"数据版本 v{data_version}：{update['time']} {update['mode']} {update['file']}"
+                               f"（共{update['rows']}条）")
+        if store.last_error:
+            st.sidebar.warning(f"最近一次刷新失败：{store.last_error}")
+
+    # 页面选择
+    page = st.sidebar.radio("📑 页面：", ["📊 销售概览", "📈 趋势分析", "🔮 销售预测", "🔎 分店钻取"], horizontal=True)
 
     # 侧边栏筛选器（匹配效果图的3个筛选项）
     st.sidebar.header("🔍 请筛选数据：")
 
     # 筛选1：城市（默认全选）
-    city_options = df["city"].unique()
+    city_options = cube["city"].unique()
     selected_cities = st.sidebar.multiselect(
         "选择城市：",
         options=city_options,
         default=city_options
     )
-    df_filtered = df_filtered[df_filtered["city"].isin(selected_cities)]
 
     # 筛选2：顾客类型（默认全选）
-    customer_options = df["customer_type"].unique()
+    customer_options = cube["customer_type"].unique()
     selected_customers = st.sidebar.multiselect(
         "选择顾客类型：",
         options=customer_options,
         default=customer_options
     )
-    df_filtered = df_filtered[df_filtered["customer_type"].isin(selected_customers)]
 
     # 筛选3：性别（默认全选）
-    gender_options = df["gender"].unique()
+    gender_options = cube["gender"].unique()
     selected_genders = st.sidebar.multiselect(
         "选择性别：",
         options=gender_options,
         default=gender_options
     )
-    df_filtered = df_filtered[df_filtered["gender"].isin(selected_genders)]
+
+    selections = {
+        "city": selected_cities,
+        "customer_type": selected_customers,
+        "gender": selected_genders,
+    }
+    # 预聚合立方体：筛选和汇总都在立方体上完成，不复制、不扫描原始数据
+    cube_slice = slice_cube(cube, selections)
 
     # 筛选后数据量提示
     st.sidebar.markdown("---")
-    st.sidebar.info(f"筛选后记录数：{len(df_filtered)} 条")
-
-    # 生成KPI和图表（筛选后的数据）
-    generate_kpi(df_filtered)
-    generate_charts(df_filtered)
+    st.sidebar.info(f"筛选后记录数：{cube_slice['orders'].sum()} 条")
+
+    if page == "📈 趋势分析":
+        show_trend_page(store, selections)
+        return
+    if page == "🔮 销售预测":
+        show_forecast_page(store, cube)
+        return
+    if page == "🔎 分店钻取":
+        show_drill_page(store, selections)
+        return
+
+    # 生成KPI和图表（筛选后的立方体单元格）
+    generate_kpi(cube_slice)
+    generate_charts(cube_slice)
+
+    # 订单明细：由位图索引取行号，只取出展示的行
+    with st.expander("📋 筛选后的订单明细（前100条）"):
+        row_indices = load_filter_index(df, data_version).row_indices(selections)
+        st.dataframe(df.iloc[row_indices[:100]], hide_index=True)
+    show_export_panel(df, data_version, store.content_key(data_version), selections)
 
 
 # 7. 运行入口
@@ -0,0 +1,44 @@
+"""
+应用共用的小工具
+
+  - write_atomic / write_json_atomic：先写临时文件再 os.replace 替换。
+    其他进程/会话可能正在读取或以内存映射方式打开旧文件，原地覆盖会让它们读到写了一半的数据，
+    内存映射的文件被截断时进程还会因 SIGBUS 崩溃；替换后旧的文件句柄和映射仍指向旧文件。
+  - quiet_streamlit_logging：命令行脚本导入 Streamlit 应用模块时屏蔽“缺少运行时”提示。
+"""
+import json
+import os
+import threading
+
+
+# ===================== 原子写文件 =====================
+def write_atomic(path, write):
+    """调用 write(临时路径) 写出文件后替换 path；写出失败时删除临时文件，原文件保持不变。
+    临时文件名带进程号和线程号，同一进程内的多个会话同时写同一文件也不会冲突"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def write_json_atomic(path, obj, **dump_kwargs):
+    """以 UTF-8 原子写出 JSON 文件（中文不转义）"""
+    def write(tmp_path):
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(obj, f, ensure_ascii=False, **dump_kwargs)
+    return write_atomic(path, write)
+
+
+# ===================== 命令行脚本 =====================
+def quiet_streamlit_logging():
+    """以脚本方式导入应用模块前调用：没有 Streamlit 运行时，st.* 调用会反复输出警告"""
+    import streamlit.logger
+    from streamlit import config as st_config
+
+    st_config.set_option("logger.level", "error")
+    streamlit.logger.set_log_level("error")
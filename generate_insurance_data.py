@@ -0,0 +1,37 @@
+"""
+医疗费用示例数据生成器（压测/规模测试用）
+
+按固定大小分块生成任意行数的示例数据，逐块写成 Parquet 或 GBK 编码的 CSV 分区，
+列名和类别取值与 insurance-chinese.csv 一致，内存占用只与分块大小有关。
+
+用法：python generate_insurance_data.py --rows 100000000 --chunk-size 1000000 --format parquet --out artifacts/synthetic_insurance
+"""
+import argparse
+import os
+import time
+
+from app_utils import quiet_streamlit_logging
+
+quiet_streamlit_logging()
+
+from medical_predictor_simple import write_sample_partitions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分块生成医疗费用示例数据")
+    parser.add_argument('--rows', type=int, required=True, help="总行数")
+    parser.add_argument('--chunk-size', type=int, default=1_000_000, help="每个分区文件的行数")
+    parser.add_argument('--seed', type=int, default=42, help="随机数种子")
+    parser.add_argument('--format', choices=['parquet', 'csv'], default='parquet', help="输出格式")
+    parser.add_argument('--out', default=os.path.join('artifacts', 'synthetic_insurance'),
+                        help="输出目录")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    paths = write_sample_partitions(args.out, args.rows, args.chunk_size, args.seed, args.format)
+    elapsed = time.perf_counter() - start
+    print(f"已生成 {args.rows:,} 行，{len(paths)} 个分区 → {args.out}（耗时 {elapsed:.1f} 秒）")
+
+
+if __name__ == "__main__":
+    main()
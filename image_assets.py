@@ -0,0 +1,129 @@
+"""
+图片资源缓存 —— 按显示宽度预先缩放的 WebP/PNG 图片
+
+st.image 每次重跑都会读取原图、重新编码并通过 WebSocket 发送完整图片，
+而页面实际只以 100~400 像素宽显示。这里按“源文件内容哈希 + 宽度”懒生成缩放后的图片，
+写入 static/assets/，由 Streamlit 静态文件服务（.streamlit/config.toml 中
+server.enableStaticServing = true）以 app/static/... 地址直接提供，浏览器可缓存。
+
+也可以在部署前预先生成全部变体：
+用法：python image_assets.py [--widths 100 300 400] [--format webp]
+"""
+import argparse
+import glob
+import hashlib
+import html
+import os
+
+import streamlit as st
+from PIL import Image
+
+from app_utils import quiet_streamlit_logging, write_atomic
+
+if __name__ == "__main__":
+    quiet_streamlit_logging()
+
+IMAGE_DIR = 'images'
+# Streamlit 只对主脚本同目录下的 static/ 提供静态服务
+STATIC_DIR = 'static'
+ASSET_SUBDIR = 'assets'
+STATIC_URL_PREFIX = 'app/static'
+# 未指定宽度（铺满容器）时生成的响应式宽度
+RESPONSIVE_WIDTHS = (480, 960, 1440)
+WEBP_QUALITY = 90
+
+
+# ===================== 生成缩放变体 =====================
+def source_hash(path):
+    """源文件内容哈希（替换同名图片后自动生成新变体，旧地址不会命中浏览器缓存）"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def build_variant(path, width, fmt='webp', out_dir=os.path.join(STATIC_DIR, ASSET_SUBDIR)):
+    """生成（或复用）指定宽度的图片变体，返回 (相对 static/ 的路径, 实际宽度)；不放大原图"""
+    with Image.open(path) as img:
+        src_width, src_height = img.size
+        width = min(int(width), src_width)
+        name = f"{source_hash(path)}_{width}w.{fmt}"
+        out_path = os.path.join(out_dir, name)
+        if not os.path.exists(out_path):
+            os.makedirs(out_dir, exist_ok=True)
+            if width < src_width:
+                resized = img.resize((width, max(1, round(src_height * width / src_width))), Image.LANCZOS)
+            else:
+                resized = img.copy()
+            if resized.mode not in ('RGB', 'RGBA'):
+                resized = resized.convert('RGBA')
+            # 原子替换，避免并发会话读到写了一半的图片
+            if fmt == 'webp':
+                write_atomic(out_path, lambda tmp_path: resized.save(tmp_path, format='WEBP', quality=WEBP_QUALITY))
+            else:
+                write_atomic(out_path, lambda tmp_path: resized.save(tmp_path, format='PNG', optimize=True))
+    return f"{ASSET_SUBDIR}/{name}", width
+
+
+@st.cache_data(show_spinner=False)
+def get_variant_url(path, width, fmt, mtime, size):
+    """返回变体的静态地址；源文件修改时间/大小作为缓存键，命中时不读取图片"""
+    relative_path, actual_width = build_variant(path, width, fmt)
+    return f"{STATIC_URL_PREFIX}/{relative_path}", actual_width
+
+
+def _variant_url(path, width, fmt):
+    stat = os.stat(path)
+    return get_variant_url(path, width, fmt, stat.st_mtime, stat.st_size)
+
+
+# ===================== 页面显示 =====================
+def show_image(path, width=None, caption=None, fmt='webp'):
+    """显示缩放后的图片（替代 st.image）：指定 width 时提供 1x/2x 两个变体，
+    否则按 RESPONSIVE_WIDTHS 生成响应式变体铺满容器；未开启静态服务时退回 st.image"""
+    if not st.get_option('server.enableStaticServing'):
+        if width is None:
+            st.image(path, caption=caption, use_container_width=True)
+        else:
+            st.image(path, caption=caption, width=width)
+        return
+
+    alt = html.escape(caption or os.path.splitext(os.path.basename(path))[0])
+    if width is not None:
+        url_1x, width_1x = _variant_url(path, width, fmt)
+        url_2x, _ = _variant_url(path, 2 * width, fmt)
+        img_tag = (f'<img src="{url_1x}" srcset="{url_1x} 1x, {url_2x} 2x" '
+                   f'width="{width_1x}" alt="{alt}">')
+    else:
+        variants = sorted({_variant_url(path, w, fmt) for w in RESPONSIVE_WIDTHS}, key=lambda v: v[1])
+        srcset = ', '.join(f'{url} {w}w' for url, w in variants)
+        img_tag = (f'<img src="{variants[-1][0]}" srcset="{srcset}" sizes="100vw" '
+                   f'style="width:100%;height:auto" alt="{alt}">')
+
+    caption_tag = ''
+    if caption:
+        caption_tag = (f'<div style="text-align:center;color:rgba(49,51,63,0.6);font-size:0.875rem">'
+                       f'{html.escape(caption)}</div>')
+    st.markdown(f'<div>{img_tag}{caption_tag}</div>', unsafe_allow_html=True)
+
+
+# ===================== 命令行入口 =====================
+def main():
+    parser = argparse.ArgumentParser(description="预先生成 images/ 下图片的缩放变体")
+    parser.add_argument('--widths', type=int, nargs='*', default=[100, 300, 400],
+                        help="显示宽度（同时生成 2 倍宽度的高清变体）")
+    parser.add_argument('--format', choices=['webp', 'png'], default='webp', help="输出格式")
+    args = parser.parse_args()
+
+    widths = sorted(set(args.widths) | {2 * w for w in args.widths} | set(RESPONSIVE_WIDTHS))
+    for path in sorted(glob.glob(os.path.join(IMAGE_DIR, '*'))):
+        src_size = os.path.getsize(path)
+        outputs = [build_variant(path, w, args.format) for w in widths]
+        sizes = ', '.join(f"{w}px {os.path.getsize(os.path.join(STATIC_DIR, p)) / 1024:.0f}KB"
+                          for p, w in dict.fromkeys(outputs))
+        print(f"{path}（{src_size / 1024:.0f}KB）→ {sizes}")
+
+
+if __name__ == "__main__":
+    main()
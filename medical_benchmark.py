@@ -0,0 +1,141 @@
+"""
+医疗费用预测 —— 模型基准测试
+
+在 insurance-chinese.csv 和 generate_sample_data 生成的大规模示例数据上，
+对比随机森林、直方图梯度提升、极端随机树、岭回归和规则引擎的：
+训练耗时、单条预测延迟(p50/p99)、1万行批量吞吐、模型大小、MAE/R²。
+
+用法：python medical_benchmark.py --sizes 10000 100000 --output artifacts/medical_benchmark.json
+"""
+import argparse
+import json
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+
+from app_utils import quiet_streamlit_logging
+
+quiet_streamlit_logging()
+
+import medical_predictor_simple as app
+from sklearn.ensemble import ExtraTreesRegressor, HistGradientBoostingRegressor, RandomForestRegressor
+from sklearn.linear_model import Ridge
+from sklearn.metrics import mean_absolute_error, r2_score
+from sklearn.model_selection import train_test_split
+
+
+# ===================== 候选模型 =====================
+MODEL_FACTORIES = {
+    'RandomForest': lambda: RandomForestRegressor(**app.RF_PARAMS, n_jobs=-1),
+    'HistGradientBoosting': lambda: HistGradientBoostingRegressor(random_state=42),
+    'ExtraTrees': lambda: ExtraTreesRegressor(n_estimators=100, random_state=42, n_jobs=-1),
+    'Ridge': lambda: Ridge(alpha=1.0),
+    'Rules': None,  # 现有 predict_with_rules 规则引擎，无需训练
+}
+
+
+# ===================== 数据集 =====================
+def load_datasets(sizes):
+    """真实数据集 + 不同规模的示例数据集，均为英文列名的原始数据"""
+    datasets = {}
+    if os.path.exists('insurance-chinese.csv'):
+        datasets['insurance'] = app.read_insurance_csv('insurance-chinese.csv').dropna()
+    for n in sizes:
+        # generate_sample_data 带有 st.cache_data 装饰，这里直接调用原函数避免缓存大表
+        df, _ = app.generate_sample_data.__wrapped__(n_samples=n)
+        datasets[f'synthetic_{n}'] = df
+    return datasets
+
+
+# ===================== 单个模型测量 =====================
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000)
+
+
+def benchmark_model(name, train_df, test_df, schema, repeat, batch_rows):
+    """训练并测量一个模型，返回一行结果"""
+    factory = MODEL_FACTORIES[name]
+    model = None
+    fit_seconds = 0.0
+    if factory is not None:
+        model = factory()
+        start = time.perf_counter()
+        model.fit(schema.transform(train_df), train_df['charges'].to_numpy(dtype=float))
+        fit_seconds = time.perf_counter() - start
+        # 与线上一致：训练并行，预测单线程
+        if 'n_jobs' in model.get_params():
+            model.set_params(n_jobs=None)
+
+    # 准确度（测试集）
+    y_pred, _ = app.predict_medical_cost_batch(test_df, model, schema)
+    y_true = test_df['charges'].to_numpy(dtype=float)
+
+    # 单条预测延迟：走线上同一条路径（编码 + 预测）
+    rows = test_df.sample(n=repeat, replace=True, random_state=0)
+    latencies = []
+    for row in rows.itertuples(index=False):
+        start = time.perf_counter()
+        app.predict_medical_cost(row.age, row.sex, row.bmi, row.children, row.smoker, row.region,
+                                 rf_model=model, schema=schema)
+        latencies.append(time.perf_counter() - start)
+
+    # 批量吞吐
+    batch = test_df.sample(n=batch_rows, replace=True, random_state=0)
+    start = time.perf_counter()
+    app.predict_medical_cost_batch(batch, model, schema)
+    batch_seconds = time.perf_counter() - start
+
+    return {
+        'model': name,
+        'fit_seconds': round(fit_seconds, 4),
+        'p50_ms': round(percentile_ms(latencies, 50), 3),
+        'p99_ms': round(percentile_ms(latencies, 99), 3),
+        'batch_rows_per_sec': round(batch_rows / batch_seconds, 1),
+        'size_mb': round(len(pickle.dumps(model)) / 1024 ** 2, 3) if model is not None else 0.0,
+        'MAE': round(float(mean_absolute_error(y_true, y_pred)), 2),
+        'R2': round(float(r2_score(y_true, y_pred)), 4),
+    }
+
+
+def run_benchmark(sizes, repeat=200, batch_rows=10000, models=None):
+    """对每个数据集、每个模型执行测量，返回结果 DataFrame"""
+    results = []
+    for dataset_name, df in load_datasets(sizes).items():
+        train_df, test_df = train_test_split(df, test_size=0.2, random_state=42)
+        schema = app.FeatureSchema().fit(train_df)
+        for name in models or MODEL_FACTORIES:
+            row = benchmark_model(name, train_df, test_df, schema, repeat, batch_rows)
+            row = {'dataset': dataset_name, 'rows': len(df), **row}
+            results.append(row)
+            print(f"  {dataset_name:<20} {name:<22} 完成")
+    return pd.DataFrame(results)
+
+
+# ===================== 命令行入口 =====================
+def main():
+    parser = argparse.ArgumentParser(description="医疗费用预测模型基准测试")
+    parser.add_argument('--sizes', type=int, nargs='*', default=[10000, 100000],
+                        help="示例数据集行数（可多个）")
+    parser.add_argument('--models', nargs='*', choices=list(MODEL_FACTORIES), default=None,
+                        help="只测试指定模型，默认全部")
+    parser.add_argument('--repeat', type=int, default=200, help="单条预测延迟的采样次数")
+    parser.add_argument('--batch-rows', type=int, default=10000, help="批量吞吐测试的行数")
+    parser.add_argument('--output', default=os.path.join('artifacts', 'medical_benchmark.json'),
+                        help="JSON 结果文件路径")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.sizes, args.repeat, args.batch_rows, args.models)
+    print()
+    print(results.to_string(index=False))
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results.to_dict(orient='records'), f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存：{args.output}")
+
+
+if __name__ == "__main__":
+    main()
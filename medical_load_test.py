@@ -0,0 +1,144 @@
+"""
+医疗费用预测表单 —— 并发会话压测
+
+基于 streamlit.testing.v1.AppTest 在同一进程内模拟 N 个并发会话（与单个 Streamlit
+服务进程共享缓存的方式一致），每个会话进入“预测分析”页面后多次以随机输入提交
+prediction_form，统计脚本运行延迟分位数、吞吐量，并检查模型是否被复用而非重复训练。
+
+说明：AppTest 每次运行都会替换进程级的 Runtime 实例和配置，不能真正并行执行，
+因此各会话线程并发排队、脚本运行逐个执行。报告同时给出用户感知延迟（含排队）
+和单次脚本运行耗时；受 GIL 限制，单进程的真实吞吐与此接近。
+
+用法：python medical_load_test.py --sessions 8 --submits 5 [--cold]
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from streamlit.testing.v1 import AppTest
+
+APP_FILE = "medical_predictor_simple.py"
+MODEL_ARTIFACT_PATH = os.path.join("artifacts", "medical_rf_model.joblib")
+
+# AppTest 运行会修改进程级全局状态，同一时刻只允许一个脚本运行
+_RUN_LOCK = threading.Lock()
+
+
+# ===================== 单个会话 =====================
+def _widget(widgets, label):
+    """按标签查找控件（表单控件没有设置 key）"""
+    for widget in widgets:
+        if widget.label == label:
+            return widget
+    raise LookupError(f"未找到控件：{label}")
+
+
+def _timed_run(element, timeout):
+    """执行一次脚本重跑，返回 (含排队的总耗时, 脚本运行耗时)，单位秒"""
+    start = time.perf_counter()
+    with _RUN_LOCK:
+        run_start = time.perf_counter()
+        element.run(timeout=timeout)
+    end = time.perf_counter()
+    return end - start, end - run_start
+
+
+def run_session(session_id, submits, timeout, seed):
+    """模拟一个用户会话：打开页面 → 进入预测分析 → 多次随机提交表单"""
+    rng = random.Random(seed + session_id)
+    at = AppTest.from_file(APP_FILE, default_timeout=timeout)
+    result = {'session': session_id, 'page_runs': [], 'submit_runs': [], 'errors': [], 'model_load_stats': None}
+
+    result['page_runs'].append(_timed_run(at, timeout))
+    result['page_runs'].append(_timed_run(_widget(at.sidebar.button, "💰 预测分析").click(), timeout))
+
+    for _ in range(submits):
+        _widget(at.number_input, "年龄").set_value(rng.randint(18, 64))
+        _widget(at.number_input, "BMI").set_value(round(rng.uniform(16, 45), 1))
+        _widget(at.number_input, "子女数量").set_value(rng.randint(0, 5))
+        _widget(at.radio, "性别").set_value(rng.choice(["男性", "女性"]))
+        _widget(at.radio, "是否吸烟").set_value(rng.choice(["否", "是"]))
+        _widget(at.selectbox, "区域").set_value(rng.choice(["东南部", "西南部", "西北部", "东北部"]))
+        result['submit_runs'].append(_timed_run(_widget(at.button, "预测费用").click(), timeout))
+        result['errors'].extend(str(e.value) for e in at.exception)
+
+    if 'model_load_stats' in at.session_state:
+        result['model_load_stats'] = at.session_state['model_load_stats']
+    return result
+
+
+# ===================== 汇总报告 =====================
+def summarize(results, wall_seconds):
+    """汇总各会话结果：延迟分位数、吞吐量、错误数、模型加载统计"""
+    submit_runs = np.array([t for r in results for t, _ in r['submit_runs']])
+    submit_service = np.array([t for r in results for _, t in r['submit_runs']])
+    page_runs = np.array([t for r in results for t, _ in r['page_runs']])
+    stats = [r['model_load_stats'] for r in results if r['model_load_stats']]
+    # 各会话看到的统计是进程级累计值，取最大值即为整个压测期间的总次数
+    loaded = max((s['loaded'] for s in stats), default=0)
+    trained = max((s['trained'] for s in stats), default=0)
+
+    def pct(values, q):
+        return round(float(np.percentile(values, q) * 1000), 1) if len(values) else None
+
+    return {
+        'sessions': len(results),
+        'submits': int(len(submit_runs)),
+        'submit_p50_ms': pct(submit_runs, 50),
+        'submit_p90_ms': pct(submit_runs, 90),
+        'submit_p99_ms': pct(submit_runs, 99),
+        'script_run_p50_ms': pct(submit_service, 50),
+        'script_run_p99_ms': pct(submit_service, 99),
+        'page_p50_ms': pct(page_runs, 50),
+        'page_p99_ms': pct(page_runs, 99),
+        'throughput_submits_per_sec': round(len(submit_runs) / wall_seconds, 2),
+        'wall_seconds': round(wall_seconds, 2),
+        'errors': sum(len(r['errors']) for r in results),
+        'model_loaded_from_file': loaded,
+        'model_trained': trained,
+        'model_reused': loaded + trained <= 1,
+    }
+
+
+# ===================== 命令行入口 =====================
+def main():
+    parser = argparse.ArgumentParser(description="医疗费用预测表单并发压测")
+    parser.add_argument('--sessions', type=int, default=8, help="并发会话数")
+    parser.add_argument('--submits', type=int, default=5, help="每个会话提交表单的次数")
+    parser.add_argument('--timeout', type=float, default=120, help="单次脚本运行超时（秒）")
+    parser.add_argument('--seed', type=int, default=42, help="随机输入种子")
+    parser.add_argument('--cold', action='store_true', help="压测前删除已保存的模型文件，模拟冷启动")
+    parser.add_argument('--output', default=None, help="可选：把汇总结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    if args.cold and os.path.exists(MODEL_ARTIFACT_PATH):
+        os.remove(MODEL_ARTIFACT_PATH)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions, thread_name_prefix="session") as pool:
+        futures = [pool.submit(run_session, i, args.submits, args.timeout, args.seed)
+                   for i in range(args.sessions)]
+        results = [f.result() for f in futures]
+    summary = summarize(results, time.perf_counter() - start)
+
+    for key, value in summary.items():
+        print(f"{key:<28} {value}")
+    if not summary['model_reused']:
+        print("⚠️ 检测到模型被重复加载/训练：缓存没有在会话间复用")
+    if summary['errors']:
+        print("⚠️ 部分会话出现异常：")
+        for message in sorted({e for r in results for e in r['errors']}):
+            print(f"  - {message}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
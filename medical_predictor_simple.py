@@ -1,11 +1,18 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import os
+import json
+import hashlib
+import io
+import time
+from datetime import datetime
+from app_utils import write_atomic, write_json_atomic
 try:
-    from sklearn.model_selection import train_test_split
+    import joblib
+    import sklearn
     from sklearn.ensemble import RandomForestRegressor
-    from sklearn.preprocessing import LabelEncoder
-    from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+    from sklearn.metrics import mean_absolute_error, mean_squared_error
     SKLEARN_AVAILABLE = True
 except ImportError:
     SKLEARN_AVAILABLE = False
@@ -18,6 +25,12 @@ try:
 except ImportError:
     PLOTLY_AVAILABLE = False
 
+try:
+    from openpyxl import Workbook
+    OPENPYXL_AVAILABLE = True
+except ImportError:
+    OPENPYXL_AVAILABLE = False
+
 # ===================== 页面配置 =====================
 st.set_page_config(
     page_title="🏥 医疗费用预测系统",
@@ -89,6 +102,85 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# ===================== 特征编码方案 =====================
+# 表单选项（同时决定报价网格各维度的顺序）
+SEX_OPTIONS = ['男性', '女性']
+SMOKER_OPTIONS = ['否', '是']
+REGION_OPTIONS = ['东南部', '西南部', '西北部', '东北部']
+
+# 上传文件（与 insurance-chinese.csv 同结构）的中文列名 → 内部英文列名
+INSURANCE_COLUMNS = {
+    '年龄': 'age', '性别': 'sex', 'BMI': 'bmi', '子女数量': 'children',
+    '是否吸烟': 'smoker', '区域': 'region', '医疗费用': 'charges'
+}
+
+class FeatureSchema:
+    """
+    特征编码方案：在训练数据上拟合一次并随模型保存，
+    训练数据、表单单条输入和批量文件统一通过 transform 向量化编码
+    """
+    CATEGORICAL_COLUMNS = ['sex', 'smoker', 'region']
+    FEATURES = ['age', 'sex_encoded', 'bmi', 'children', 'smoker_encoded', 'region_encoded']
+
+    def __init__(self, categories=None):
+        self.categories = categories or {}
+
+    def fit(self, df):
+        """记录每个类别列的取值（按字典序排列，与 LabelEncoder 编码一致）"""
+        self.categories = {
+            col: sorted(df[col].dropna().astype(str).unique().tolist())
+            for col in self.CATEGORICAL_COLUMNS
+        }
+        return self
+
+    def encode(self, col, values):
+        """向量化编码单个类别列，出现训练数据中没有的取值时报错"""
+        codes = pd.Categorical(values, categories=self.categories[col]).codes
+        if (codes < 0).any():
+            unknown = sorted(set(map(str, np.asarray(values, dtype=object)[codes < 0])))
+            raise ValueError(f"字段 {col} 存在未知取值: {unknown}")
+        return codes
+
+    def transform(self, df):
+        """把原始数据（英文列名）编码为模型输入矩阵，列顺序见 FEATURES"""
+        X = np.empty((len(df), len(self.FEATURES)), dtype=float)
+        for i, feature in enumerate(self.FEATURES):
+            col = feature.replace('_encoded', '')
+            if col in self.CATEGORICAL_COLUMNS:
+                X[:, i] = self.encode(col, df[col].to_numpy())
+            else:
+                X[:, i] = df[col].to_numpy(dtype=float)
+        return X
+
+    def transform_one(self, age, sex, bmi, children, smoker, region):
+        """编码单条表单输入"""
+        return self.transform(pd.DataFrame({
+            'age': [age], 'sex': [sex], 'bmi': [bmi],
+            'children': [children], 'smoker': [smoker], 'region': [region]
+        }))
+
+    def to_dict(self):
+        """转换为可 JSON 序列化的字典，用于随模型持久化"""
+        return {'features': self.FEATURES, 'categories': self.categories}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(categories=data['categories'])
+
+def read_insurance_csv(source):
+    """读取与 insurance-chinese.csv 同结构的CSV（自动识别编码），列名转换为英文"""
+    for encoding in ['utf-8', 'gbk', 'gb2312', 'utf-8-sig']:
+        try:
+            if hasattr(source, 'seek'):
+                source.seek(0)
+            df = pd.read_csv(source, encoding=encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        raise ValueError("无法识别文件编码")
+    return df.rename(columns=INSURANCE_COLUMNS)
+
 # ===================== 数据加载和预处理 =====================
 @st.cache_data
 def load_and_preprocess_data():
@@ -116,19 +208,10 @@ def load_and_preprocess_data():
         # 数据清洗
         df = df.dropna()
         
-        if SKLEARN_AVAILABLE:
-            # 标签编码
-            le_sex = LabelEncoder()
-            le_smoker = LabelEncoder()
-            le_region = LabelEncoder()
-            
-            df['sex_encoded'] = le_sex.fit_transform(df['sex'])
-            df['smoker_encoded'] = le_smoker.fit_transform(df['smoker'])
-            df['region_encoded'] = le_region.fit_transform(df['region'])
-            
-            return df, le_sex, le_smoker, le_region
-        else:
-            return df, None, None, None
+        # 特征编码方案：只在训练数据上拟合一次，训练和预测共用
+        schema = FeatureSchema().fit(df)
+        
+        return df, schema
             
     except Exception as e:
         st.warning(f"⚠️ 数据加载失败: {e}")
@@ -136,85 +219,165 @@ def load_and_preprocess_data():
         return generate_sample_data()
 
 @st.cache_data
-def generate_sample_data():
-    """生成示例数据"""
-    np.random.seed(42)
-    n_samples = 1000
-    
-    data = {
-        'age': np.random.randint(18, 80, n_samples),
-        'sex': np.random.choice(['男性', '女性'], n_samples),
-        'bmi': np.random.normal(25, 5, n_samples),
-        'children': np.random.randint(0, 6, n_samples),
-        'smoker': np.random.choice(['否', '是'], n_samples, p=[0.8, 0.2]),
-        'region': np.random.choice(['东南部', '西南部', '西北部', '东北部'], n_samples)
-    }
-    
-    df = pd.DataFrame(data)
-    df['bmi'] = np.clip(df['bmi'], 15, 50)
-    
-    # 生成费用数据
-    base_cost = 5000
-    age_factor = df['age'] * 100
-    bmi_factor = np.where(df['bmi'] > 30, (df['bmi'] - 30) * 500, 0)
-    smoker_factor = np.where(df['smoker'] == '是', 15000, 0)
-    children_factor = df['children'] * 1000
-    
-    df['charges'] = (base_cost + age_factor + bmi_factor + 
-                    smoker_factor + children_factor + 
-                    np.random.normal(0, 2000, n_samples))
+def generate_sample_data(n_samples=1000, seed=42):
+    """生成示例数据（n_samples 可调大，用于模型基准测试）"""
+    df = pd.concat(iter_sample_data(n_samples, seed=seed), ignore_index=True)
+    return df, FeatureSchema().fit(df)
+
+def iter_sample_data(n_rows, chunk_size=1_000_000, seed=42):
+    """
+    按固定大小分块生成示例数据（英文列名），内存占用只与 chunk_size 有关
+    每块使用由 seed 派生的独立随机数种子，相同的 n_rows/chunk_size/seed 结果完全一致
+    """
+    n_chunks = max(1, -(-n_rows // chunk_size))
+    seeds = np.random.SeedSequence(seed).spawn(n_chunks)
+    for i, chunk_seed in enumerate(seeds):
+        n = min(chunk_size, n_rows - i * chunk_size)
+        if n <= 0:
+            break
+        rng = np.random.default_rng(chunk_seed)
+        
+        df = pd.DataFrame({
+            'age': rng.integers(18, 80, n),
+            'sex': rng.choice(np.array(SEX_OPTIONS, dtype=object), n),
+            'bmi': np.clip(rng.normal(25, 5, n), 15, 50).round(1),
+            'children': rng.integers(0, 6, n),
+            'smoker': rng.choice(np.array(SMOKER_OPTIONS, dtype=object), n, p=[0.8, 0.2]),
+            'region': rng.choice(np.array(REGION_OPTIONS, dtype=object), n)
+        })
+        
+        # 生成费用数据
+        base_cost = 5000
+        age_factor = df['age'] * 100
+        bmi_factor = np.where(df['bmi'] > 30, (df['bmi'] - 30) * 500, 0)
+        smoker_factor = np.where(df['smoker'] == '是', 15000, 0)
+        children_factor = df['children'] * 1000
+        
+        charges = (base_cost + age_factor + bmi_factor + 
+                   smoker_factor + children_factor + 
+                   rng.normal(0, 2000, n))
+        df['charges'] = np.maximum(charges, 1000).round(2)
+        
+        yield df
+
+def write_sample_partitions(out_dir, n_rows, chunk_size=1_000_000, seed=42, fmt='parquet'):
+    """
+    把分块生成的示例数据逐块写成分区文件，列名与 insurance-chinese.csv 相同（中文）
+    fmt='csv' 时使用 GBK 编码，与原始CSV一致；fmt='parquet' 需要 pyarrow
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    chinese_columns = {v: k for k, v in INSURANCE_COLUMNS.items()}
+    paths = []
+    for i, chunk in enumerate(iter_sample_data(n_rows, chunk_size, seed)):
+        chunk = chunk.rename(columns=chinese_columns)
+        path = os.path.join(out_dir, f"part-{i:05d}.{fmt}")
+        if fmt == 'parquet':
+            chunk.to_parquet(path, index=False)
+        elif fmt == 'csv':
+            chunk.to_csv(path, index=False, encoding='gbk')
+        else:
+            raise ValueError(f"不支持的输出格式: {fmt}")
+        paths.append(path)
+    return paths
+
+# ===================== 机器学习模型训练 =====================
+# 全量数据并行训练 + 袋外(OOB)评估，结果保存为模型文件供各进程复用
+MODEL_ARTIFACT_PATH = os.path.join('artifacts', 'medical_rf_model.joblib')
+RF_PARAMS = {'n_estimators': 100, 'random_state': 42}
+
+def data_fingerprint(df, schema):
+    """训练数据 + 编码方案 + 模型参数的指纹，用于判断已保存的模型能否直接复用"""
+    columns = [col for col in INSURANCE_COLUMNS.values() if col in df.columns]
+    digest = hashlib.sha1(pd.util.hash_pandas_object(df[columns], index=False).to_numpy().tobytes())
+    digest.update(json.dumps({'schema': schema.to_dict(), 'params': RF_PARAMS},
+                             ensure_ascii=False, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+def train_random_forest_oob(df, schema):
+    """使用全部数据并行训练随机森林，袋外(OOB)样本直接给出验证指标"""
+    X = schema.transform(df)
+    y = df['charges'].to_numpy(dtype=float)
     
-    df['charges'] = np.maximum(df['charges'], 1000)
+    start = time.perf_counter()
+    rf_model = RandomForestRegressor(**RF_PARAMS, n_jobs=-1, oob_score=True)
+    rf_model.fit(X, y)
+    fit_seconds = time.perf_counter() - start
+    # 训练时并行；在线单条预测不需要线程池调度开销
+    rf_model.set_params(n_jobs=None)
     
-    return df, None, None, None
+    oob_pred = rf_model.oob_prediction_
+    metrics = {
+        'MAE': mean_absolute_error(y, oob_pred),
+        'RMSE': float(np.sqrt(mean_squared_error(y, oob_pred))),
+        'R2': rf_model.oob_score_,
+        'validation': 'OOB',
+        'fit_seconds': fit_seconds
+    }
+    return rf_model, metrics
+
+def save_model_artifact(rf_model, schema, metrics, fingerprint, path=MODEL_ARTIFACT_PATH):
+    """保存模型、编码方案、评估指标和数据指纹（先写临时文件再替换，避免其他进程读到半个文件）"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    artifact = {
+        'model': rf_model,
+        'schema': schema.to_dict(),
+        'metrics': metrics,
+        'fingerprint': fingerprint,
+        'trained_at': datetime.now().isoformat(timespec='seconds'),
+        'sklearn_version': sklearn.__version__
+    }
+    write_atomic(path, lambda tmp_path: joblib.dump(artifact, tmp_path, compress=3))
+
+def load_model_artifact(path=MODEL_ARTIFACT_PATH):
+    """读取模型文件，文件不存在或无法读取（如版本不兼容）时返回 None"""
+    if not os.path.exists(path):
+        return None
+    try:
+        return joblib.load(path)
+    except Exception as e:
+        st.warning(f"⚠️ 模型文件读取失败，将重新训练: {e}")
+        return None
 
-# ===================== 机器学习模型训练 =====================
 @st.cache_resource
-def train_random_forest_model(df):
-    """训练随机森林模型"""
+def get_model_load_stats():
+    """进程级模型加载统计（从文件加载次数、训练次数），供压测检查是否出现重复训练"""
+    return {'loaded': 0, 'trained': 0}
+
+@st.cache_resource(hash_funcs={FeatureSchema: lambda schema: json.dumps(schema.to_dict(), sort_keys=True)})
+def load_or_train_model(df, schema):
+    """进程启动时优先加载与当前数据指纹一致的模型文件，否则OOB训练并保存；返回 (模型, 指标, 来源)"""
     if df is None or not SKLEARN_AVAILABLE:
-        return None, None
+        return None, None, None
+    
+    fingerprint = data_fingerprint(df, schema)
+    artifact = load_model_artifact()
+    if artifact is not None and artifact.get('fingerprint') == fingerprint:
+        get_model_load_stats()['loaded'] += 1
+        return artifact['model'], artifact['metrics'], "模型文件"
     
     try:
-        # 准备特征和目标变量
-        features = ['age', 'sex_encoded', 'bmi', 'children', 'smoker_encoded', 'region_encoded']
-        X = df[features]
-        y = df['charges']
-        
-        # 分割数据
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-        
-        # 训练随机森林模型
-        rf_model = RandomForestRegressor(n_estimators=100, random_state=42)
-        rf_model.fit(X_train, y_train)
-        
-        # 模型评估
-        rf_pred = rf_model.predict(X_test)
-        
-        metrics = {
-            'MAE': mean_absolute_error(y_test, rf_pred),
-            'RMSE': np.sqrt(mean_squared_error(y_test, rf_pred)),
-            'R2': r2_score(y_test, rf_pred)
-        }
-        
-        return rf_model, metrics
-        
+        rf_model, metrics = train_random_forest_oob(df, schema)
+        get_model_load_stats()['trained'] += 1
+        save_model_artifact(rf_model, schema, metrics, fingerprint)
+        return rf_model, metrics, "重新训练"
     except Exception as e:
         st.error(f"❌ 随机森林模型训练失败: {e}")
-        return None, None
+        return None, None, None
 # ===================== 预测函数 =====================
-def predict_medical_cost(age, sex, bmi, children, smoker, region, rf_model=None):
+RULE_REGION_FACTORS = {
+    '东南部': 1000, '西南部': 800, 
+    '西北部': 600, '东北部': 1200
+}
+
+def predict_medical_cost(age, sex, bmi, children, smoker, region, rf_model=None, quote_grid=None, schema=None):
     """使用随机森林模型预测，如果模型不可用则使用规则引擎"""
-    if rf_model is not None and SKLEARN_AVAILABLE:
+    if quote_grid is not None:
+        # 查表模式：直接按数组下标读取预计算结果
+        return lookup_quote(quote_grid, age, sex, bmi, children, smoker, region), "随机森林（查表）"
+    if rf_model is not None and schema is not None and SKLEARN_AVAILABLE:
         try:
-            # 编码输入数据
-            sex_encoded = 1 if sex == '男性' else 0
-            smoker_encoded = 1 if smoker == '是' else 0
-            region_map = {'东南部': 0, '西南部': 1, '西北部': 2, '东北部': 3}
-            region_encoded = region_map.get(region, 0)
-            
-            # 准备预测数据
-            input_data = np.array([[age, sex_encoded, bmi, children, smoker_encoded, region_encoded]])
+            # 使用与训练相同的编码方案准备预测数据
+            input_data = schema.transform_one(age, sex, bmi, children, smoker, region)
             
             # 使用随机森林预测
             prediction = rf_model.predict(input_data)[0]
@@ -243,11 +406,7 @@ def predict_with_rules(age, sex, bmi, children, smoker, region):
     children_factor = children * 1000
     sex_factor = 500 if sex == '男性' else 0
     
-    region_factors = {
-        '东南部': 1000, '西南部': 800, 
-        '西北部': 600, '东北部': 1200
-    }
-    region_factor = region_factors.get(region, 800)
+    region_factor = RULE_REGION_FACTORS.get(region, 800)
     
     total_cost = (base_cost + age_factor + bmi_factor + 
                  smoker_factor + children_factor + 
@@ -255,6 +414,339 @@ def predict_with_rules(age, sex, bmi, children, smoker, region):
     
     return max(total_cost, 1000)
 
+def predict_with_rules_batch(df):
+    """规则引擎的向量化版本，逐行结果与 predict_with_rules 一致"""
+    age = df['age'].to_numpy(dtype=float)
+    bmi = df['bmi'].to_numpy(dtype=float)
+    bmi_factor = np.select([bmi > 30, bmi < 18.5], [(bmi - 30) * 500, (18.5 - bmi) * 300], 0)
+    smoker_factor = np.where(df['smoker'].to_numpy() == '是', 15000, 0)
+    children_factor = df['children'].to_numpy(dtype=float) * 1000
+    sex_factor = np.where(df['sex'].to_numpy() == '男性', 500, 0)
+    region_factor = df['region'].map(RULE_REGION_FACTORS).fillna(800).to_numpy(dtype=float)
+    
+    total_cost = (5000 + age * 100 + bmi_factor + smoker_factor +
+                  children_factor + sex_factor + region_factor)
+    return np.maximum(total_cost, 1000)
+
+def predict_medical_cost_batch(df, rf_model=None, schema=None):
+    """批量预测：整张表一次性编码、一次性调用模型（不可用时使用向量化规则引擎）"""
+    if rf_model is not None and schema is not None and SKLEARN_AVAILABLE:
+        return np.maximum(rf_model.predict(schema.transform(df)), 1000), "随机森林"
+    return predict_with_rules_batch(df), "规则引擎"
+
+# ===================== 预计算报价网格（查表模式） =====================
+# 网格维度：性别(2) × 吸烟(2) × 区域(4) × 子女(0-10) × 年龄(0-100) × BMI
+QUOTE_GRID_PATH = os.path.join('artifacts', 'quote_grid.npy')
+MAX_CHILDREN = 10
+MAX_AGE = 100
+
+def _grid_meta_path(path):
+    """网格元数据（坐标轴、BMI分辨率、模型签名）与网格文件同名的 .json"""
+    return os.path.splitext(path)[0] + '.json'
+
+def _file_mtime(path):
+    """文件修改时间，文件不存在时返回 None（用作缓存键）"""
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+def model_signature(rf_model, schema):
+    """用固定探针样本的预测值和编码方案生成模型签名，用于判断网格是否过期"""
+    # 列顺序：age, sex, bmi, children, smoker, region（已编码）
+    probe = np.array([[18, 0, 18.0, 0, 0, 0], [30, 1, 25.0, 1, 0, 1],
+                      [45, 0, 31.5, 2, 1, 2], [64, 1, 40.0, 3, 1, 3]], dtype=float)
+    digest = hashlib.sha1(rf_model.predict(probe).astype(np.float64).tobytes())
+    digest.update(json.dumps(schema.to_dict(), ensure_ascii=False, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+def build_quote_grid(rf_model, schema, path=QUOTE_GRID_PATH, bmi_min=10.0, bmi_max=60.0, bmi_step=0.1):
+    """
+    离线批量预测整个离散输入空间，保存为 .npy 网格（float32）+ .json 元数据
+    说明：树模型在训练数据范围之外预测值恒定，因此BMI超出[bmi_min, bmi_max]时
+    取边界值即可，不影响结果；
+    其他进程可能正以内存映射方式打开旧网格，原地截断会让它们读到无效内存（SIGBUS），
+    因此网格和元数据都先写临时文件再替换：先替换网格，最后替换元数据
+    """
+    n_bmi = int(round((bmi_max - bmi_min) / bmi_step)) + 1
+    bmi_axis = bmi_min + np.arange(n_bmi) * bmi_step
+    age_axis = np.arange(MAX_AGE + 1)
+    shape = (len(SEX_OPTIONS), len(SMOKER_OPTIONS), len(REGION_OPTIONS),
+             MAX_CHILDREN + 1, MAX_AGE + 1, n_bmi)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def write_grid(tmp_path):
+        grid = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=shape)
+        # 年龄 × BMI 平面一次批量预测，按 性别/吸烟/区域/子女 分块，控制内存占用
+        ages, bmis = np.meshgrid(age_axis, bmi_axis, indexing='ij')
+        block = np.empty((ages.size, 6), dtype=float)
+        block[:, 0] = ages.ravel()
+        block[:, 2] = bmis.ravel()
+        for i, sex in enumerate(SEX_OPTIONS):
+            for j, smoker in enumerate(SMOKER_OPTIONS):
+                for k, region in enumerate(REGION_OPTIONS):
+                    for children in range(MAX_CHILDREN + 1):
+                        block[:, 1] = schema.encode('sex', [sex])[0]
+                        block[:, 3] = children
+                        block[:, 4] = schema.encode('smoker', [smoker])[0]
+                        block[:, 5] = schema.encode('region', [region])[0]
+                        pred = np.maximum(rf_model.predict(block), 1000)
+                        grid[i, j, k, children] = pred.reshape(MAX_AGE + 1, n_bmi)
+        grid.flush()
+        del grid
+    write_atomic(path, write_grid)
+
+    meta = {
+        'shape': list(shape),
+        'sex': SEX_OPTIONS,
+        'smoker': SMOKER_OPTIONS,
+        'region': REGION_OPTIONS,
+        'bmi_min': bmi_min,
+        'bmi_step': bmi_step,
+        'n_bmi': n_bmi,
+        'model_signature': model_signature(rf_model, schema),
+    }
+    write_json_atomic(_grid_meta_path(path), meta, indent=2)
+    return path
+
+@st.cache_resource
+def load_quote_grid(path=QUOTE_GRID_PATH, mtime=None):
+    """以内存映射方式加载报价网格（mtime 为元数据文件的修改时间，仅作缓存键；
+    元数据最后写出，它更新后网格已是新版本）"""
+    if mtime is None or not os.path.exists(path):
+        return None
+    with open(_grid_meta_path(path), encoding='utf-8') as f:
+        meta = json.load(f)
+    grid = np.load(path, mmap_mode='r')
+    if list(grid.shape) != meta['shape']:
+        # 网格已替换而元数据尚未写出
+        return None
+    return {'grid': grid, 'meta': meta}
+
+def snap_to_grid(quote_grid, age, bmi, children):
+    """把输入对齐到网格坐标：返回 (年龄, BMI, 子女数量) 的网格值和 BMI 下标"""
+    meta = quote_grid['meta']
+    bmi_idx = int(round((bmi - meta['bmi_min']) / meta['bmi_step']))
+    bmi_idx = min(max(bmi_idx, 0), meta['n_bmi'] - 1)
+    grid_bmi = round(meta['bmi_min'] + bmi_idx * meta['bmi_step'], 4)
+    return min(max(int(age), 0), MAX_AGE), grid_bmi, min(max(int(children), 0), MAX_CHILDREN), bmi_idx
+
+def lookup_quote(quote_grid, age, sex, bmi, children, smoker, region):
+    """O(1) 查表报价：各输入换算为网格下标后直接索引"""
+    meta = quote_grid['meta']
+    age, _, children, bmi_idx = snap_to_grid(quote_grid, age, bmi, children)
+    value = quote_grid['grid'][
+        meta['sex'].index(sex),
+        meta['smoker'].index(smoker),
+        meta['region'].index(region),
+        children,
+        age,
+        bmi_idx,
+    ]
+    return float(value)
+
+def show_quote_grid_panel(rf_model, schema):
+    """查表模式开关；返回与当前模型匹配的报价网格，未启用时返回 None"""
+    use_grid = st.checkbox("⚡ 启用查表模式（预计算报价网格）", value=False,
+                           help="预先批量计算所有输入组合的预测值，报价时直接按下标读取")
+    if not use_grid:
+        return None
+
+    quote_grid = load_quote_grid(QUOTE_GRID_PATH, _file_mtime(_grid_meta_path(QUOTE_GRID_PATH)))
+    if quote_grid is not None and quote_grid['meta']['model_signature'] != model_signature(rf_model, schema):
+        st.warning("⚠️ 报价网格与当前模型不匹配，请重新生成")
+        quote_grid = None
+
+    if quote_grid is None:
+        bmi_step = st.select_slider("BMI 分辨率", options=[0.1, 0.2, 0.5, 1.0], value=0.1)
+        if st.button("生成报价网格"):
+            with st.spinner("正在批量预测整个输入空间..."):
+                build_quote_grid(rf_model, schema, bmi_step=bmi_step)
+            quote_grid = load_quote_grid(QUOTE_GRID_PATH, _file_mtime(_grid_meta_path(QUOTE_GRID_PATH)))
+        else:
+            st.info("📢 尚未生成报价网格，当前仍使用随机森林实时预测")
+            return None
+
+    meta = quote_grid['meta']
+    st.caption(f"报价网格：{int(np.prod(meta['shape'])):,} 个组合，"
+               f"BMI 分辨率 {meta['bmi_step']}，大小 {quote_grid['grid'].nbytes / 1024 ** 2:.1f} MB")
+    return quote_grid
+
+# ===================== 随机森林特征贡献分解 =====================
+FEATURE_LABELS = {
+    'age': '年龄', 'sex_encoded': '性别', 'bmi': 'BMI',
+    'children': '子女数量', 'smoker_encoded': '是否吸烟', 'region_encoded': '区域'
+}
+
+def build_forest_contributions(rf_model):
+    """
+    预先计算每棵树每个节点的累计特征贡献（treeinterpreter 思路）：
+    沿决策路径，每次分裂引起的节点均值变化记到该分裂使用的特征上。
+    按树的层级整层向量化计算，每个模型只需构建一次
+    """
+    n_features = rf_model.n_features_in_
+    tables = []
+    for estimator in rf_model.estimators_:
+        tree = estimator.tree_
+        values = tree.value[:, 0, 0]
+        contrib = np.zeros((tree.node_count, n_features))
+        frontier = np.array([0])
+        while frontier.size:
+            internal = frontier[tree.children_left[frontier] != -1]
+            split_features = tree.feature[internal]
+            for children in (tree.children_left[internal], tree.children_right[internal]):
+                contrib[children] = contrib[internal]
+                contrib[children, split_features] += values[children] - values[internal]
+            frontier = np.concatenate([tree.children_left[internal], tree.children_right[internal]])
+        tables.append(contrib.astype(np.float32))
+    
+    bias = float(np.mean([estimator.tree_.value[0, 0, 0] for estimator in rf_model.estimators_]))
+    return {'bias': bias, 'tables': tables}
+
+def explain_forest_predictions(rf_model, contributions, X):
+    """批量计算特征贡献：返回 (基础值, 贡献矩阵)，基础值 + 每行贡献之和 = 随机森林预测值"""
+    leaves = rf_model.apply(X)
+    total = np.zeros((X.shape[0], X.shape[1]))
+    for t, table in enumerate(contributions['tables']):
+        total += table[leaves[:, t]]
+    return contributions['bias'], total / len(contributions['tables'])
+
+@st.cache_resource
+def get_forest_contributions(_rf_model, model_key):
+    """每个模型只构建一次贡献表（model_key 用于区分不同模型）"""
+    return build_forest_contributions(_rf_model)
+
+@st.cache_data
+def explain_quote(_rf_model, _schema, model_key, age, sex, bmi, children, smoker, region):
+    """单条报价的特征贡献分解，按输入缓存"""
+    contributions = get_forest_contributions(_rf_model, model_key)
+    X = _schema.transform_one(age, sex, bmi, children, smoker, region)
+    bias, contrib = explain_forest_predictions(_rf_model, contributions, X)
+    return bias, contrib[0]
+
+def add_contribution_columns(result, batch_df, rf_model, schema):
+    """批量模式：在结果表中追加基础费用和各特征贡献列"""
+    contributions = get_forest_contributions(rf_model, model_signature(rf_model, schema))
+    bias, contrib = explain_forest_predictions(rf_model, contributions, schema.transform(batch_df))
+    result['基础费用'] = round(bias, 2)
+    for i, feature in enumerate(schema.FEATURES):
+        result[f"贡献_{FEATURE_LABELS[feature]}"] = np.round(contrib[:, i], 2)
+    return result
+
+# ===================== 输入分布漂移监控 =====================
+DRIFT_NUMERIC_COLUMNS = ['age', 'bmi', 'children']
+DRIFT_CATEGORICAL_COLUMNS = ['smoker', 'sex', 'region']
+
+def _bin_ratios(bin_index, n_bins):
+    """各箱样本占比"""
+    counts = np.bincount(bin_index, minlength=n_bins)
+    return counts / max(counts.sum(), 1)
+
+def _population_stability_index(expected, actual, eps=1e-6):
+    """PSI = Σ (实际占比 - 期望占比) × ln(实际占比 / 期望占比)"""
+    expected = np.clip(expected, eps, None)
+    actual = np.clip(actual, eps, None)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+def build_drift_reference(train_df, schema, n_bins=10):
+    """
+    预计算训练数据的参考分布：数值列按分位数确定分箱边界，类别列按编码取值分箱；
+    同时保存排序后的数值列，用于计算 KS 统计量
+    """
+    reference = {}
+    for col in DRIFT_NUMERIC_COLUMNS:
+        values = np.sort(train_df[col].to_numpy(dtype=float))
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, n_bins + 1)[1:-1]))
+        bins = np.searchsorted(edges, values, side='right')
+        reference[col] = {'edges': edges, 'expected': _bin_ratios(bins, len(edges) + 1), 'sorted': values}
+    for col in DRIFT_CATEGORICAL_COLUMNS:
+        codes = schema.encode(col, train_df[col].to_numpy())
+        reference[col] = {'expected': _bin_ratios(codes, len(schema.categories[col]))}
+    return reference
+
+@st.cache_resource(hash_funcs={FeatureSchema: lambda schema: json.dumps(schema.to_dict(), sort_keys=True)})
+def get_drift_reference(train_df, schema):
+    """训练数据的参考分布只计算一次"""
+    return build_drift_reference(train_df, schema)
+
+def _ks_statistic(sorted_a, sorted_b):
+    """两样本 KS 统计量：两条经验累计分布在所有样本点上的最大差值"""
+    points = np.concatenate([sorted_a, sorted_b])
+    cdf_a = np.searchsorted(sorted_a, points, side='right') / len(sorted_a)
+    cdf_b = np.searchsorted(sorted_b, points, side='right') / len(sorted_b)
+    return float(np.max(np.abs(cdf_a - cdf_b)))
+
+def compute_drift_report(reference, batch_df, schema):
+    """对比上传数据与训练数据的分布，返回每个字段的 PSI、KS 和结论"""
+    rows = []
+    for col in DRIFT_NUMERIC_COLUMNS + DRIFT_CATEGORICAL_COLUMNS:
+        ref = reference[col]
+        if col in DRIFT_NUMERIC_COLUMNS:
+            values = batch_df[col].to_numpy(dtype=float)
+            actual = _bin_ratios(np.searchsorted(ref['edges'], values, side='right'), len(ref['expected']))
+            ks = _ks_statistic(ref['sorted'], np.sort(values))
+        else:
+            codes = schema.encode(col, batch_df[col].to_numpy())
+            actual = _bin_ratios(codes, len(ref['expected']))
+            # 类别列：按编码顺序的累计占比最大差值
+            ks = float(np.max(np.abs(np.cumsum(actual) - np.cumsum(ref['expected']))))
+        psi = _population_stability_index(ref['expected'], actual)
+        if psi < 0.1:
+            verdict = "稳定"
+        elif psi < 0.25:
+            verdict = "轻微漂移"
+        else:
+            verdict = "显著漂移"
+        rows.append({'字段': FEATURE_LABELS.get(col) or FEATURE_LABELS[f"{col}_encoded"],
+                     'PSI': round(psi, 4), 'KS': round(ks, 4), '结论': verdict})
+    return pd.DataFrame(rows)
+
+# ===================== 费率表生成 =====================
+# BMI区间及其代表值（区间中点）
+BMI_BANDS = [
+    ('<18.5', 17.0), ('18.5-24.9', 21.7), ('25-29.9', 27.5),
+    ('30-34.9', 32.5), ('35-39.9', 37.5), ('≥40', 42.5)
+]
+RATE_SHEET_COLUMNS = {
+    'age': '年龄', 'bmi_band': 'BMI区间', 'smoker': '是否吸烟', 'sex': '性别',
+    'region': '区域', 'children': '子女数量'
+}
+
+def build_rate_grid(age_min=18, age_max=80, max_children=5):
+    """枚举 年龄 × BMI区间 × 吸烟 × 性别 × 区域 × 子女数量 的全部组合"""
+    index = pd.MultiIndex.from_product(
+        [range(age_min, age_max + 1), [band for band, _ in BMI_BANDS], SMOKER_OPTIONS,
+         SEX_OPTIONS, REGION_OPTIONS, range(max_children + 1)],
+        names=list(RATE_SHEET_COLUMNS)
+    )
+    grid = index.to_frame(index=False)
+    grid['bmi'] = grid['bmi_band'].map(dict(BMI_BANDS))
+    return grid
+
+def write_rate_sheet(grid, predictions, target, model_name):
+    """使用 openpyxl 只写（流式）模式逐行写出费率表，内存占用不随单元格数量增长"""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("费率表")
+    sheet.append(list(RATE_SHEET_COLUMNS.values()) + ['预测医疗费用'])
+    columns = [grid[col].tolist() for col in RATE_SHEET_COLUMNS]
+    for row in zip(*columns, np.round(predictions, 2).tolist()):
+        sheet.append(row)
+    
+    info = workbook.create_sheet("说明")
+    info.append(['使用模型', model_name])
+    info.append(['生成时间', datetime.now().strftime('%Y-%m-%d %H:%M:%S')])
+    info.append(['组合数量', len(grid)])
+    info.append(['BMI取值', '各区间按中点计算：' + '，'.join(f"{band}={bmi}" for band, bmi in BMI_BANDS)])
+    workbook.save(target)
+    return target
+
+@st.cache_data(max_entries=4)
+def build_rate_sheet_xlsx(_rf_model, _schema, model_key, age_min, age_max, max_children):
+    """生成费率表工作簿（字节），整张网格一次批量预测；按参数和模型缓存"""
+    grid = build_rate_grid(age_min, age_max, max_children)
+    predictions, model_name = predict_medical_cost_batch(grid, _rf_model, _schema)
+    buffer = io.BytesIO()
+    write_rate_sheet(grid, predictions, buffer, model_name)
+    return buffer.getvalue(), len(grid), model_name
+
 # ===================== 页面函数 =====================
 def show_introduction():
     """显示简介页面"""
@@ -294,12 +786,13 @@ def show_prediction():
     """)
     
     # 加载数据和训练模型
-    df, le_sex, le_smoker, le_region = load_and_preprocess_data()
+    df, schema = load_and_preprocess_data()
     
     if SKLEARN_AVAILABLE:
-        rf_model, metrics = train_random_forest_model(df)
+        rf_model, metrics, model_source = load_or_train_model(df, schema)
+        st.session_state.model_load_stats = dict(get_model_load_stats())
         if rf_model is not None:
-            st.success("🌲 随机森林模型训练完成！")
+            st.success(f"🌲 随机森林模型已就绪（{model_source}）")
             
             # 显示模型性能
             with st.expander("📊 模型性能指标"):
@@ -310,6 +803,8 @@ def show_prediction():
                     st.metric("均方根误差", f"{metrics['RMSE']:.2f}")
                 with col3:
                     st.metric("决定系数 R²", f"{metrics['R2']:.3f}")
+                if metrics.get('validation') == 'OOB':
+                    st.caption(f"验证方式：袋外(OOB)评估，全部数据参与训练；训练耗时 {metrics['fit_seconds']:.2f} 秒")
         else:
             st.warning("⚠️ 随机森林训练失败，将使用规则引擎")
             rf_model = None
@@ -317,13 +812,16 @@ def show_prediction():
         st.info("📢 使用规则引擎模式（请安装scikit-learn获得随机森林功能）")
         rf_model = None
     
+    # 查表模式（可选）
+    quote_grid = show_quote_grid_panel(rf_model, schema) if rf_model is not None else None
+    
     # 表单
     with st.form("prediction_form"):
         # 年龄
         age = st.number_input("年龄", min_value=0, max_value=100, value=30, step=1)
         
         # 性别
-        sex = st.radio("性别", ["男性", "女性"], horizontal=True)
+        sex = st.radio("性别", SEX_OPTIONS, horizontal=True)
         
         # BMI
         bmi = st.number_input("BMI", min_value=0.0, max_value=100.0, value=25.0, step=0.1, format="%.2f")
@@ -332,10 +830,10 @@ def show_prediction():
         children = st.number_input("子女数量", min_value=0, max_value=10, value=0, step=1)
         
         # 是否吸烟
-        smoker = st.radio("是否吸烟", ["否", "是"], horizontal=True)
+        smoker = st.radio("是否吸烟", SMOKER_OPTIONS, horizontal=True)
         
         # 区域
-        region = st.selectbox("区域", ["东南部", "西南部", "西北部", "东北部"])
+        region = st.selectbox("区域", REGION_OPTIONS)
         
         # 预测按钮
         submitted = st.form_submit_button("预测费用")
@@ -343,7 +841,7 @@ def show_prediction():
         if submitted:
             if age > 0 and bmi > 0:
                 # 使用随机森林进行预测
-                prediction, model_name = predict_medical_cost(age, sex, bmi, children, smoker, region, rf_model)
+                prediction, model_name = predict_medical_cost(age, sex, bmi, children, smoker, region, rf_model, quote_grid, schema)
                 
                 # 显示预测结果
                 st.markdown("---")
@@ -388,7 +886,21 @@ def show_prediction():
                             st.write(f"**吸烟因子**: ¥{smoker_factor:,.2f}")
                         if children_factor > 0:
                             st.write(f"**子女因子**: ¥{children_factor:,.2f}")
-                elif model_name == "随机森林":
+                elif model_name.startswith("随机森林"):
+                    with st.expander("💡 费用构成分析"):
+                        # 查表模式的报价是网格坐标上的预测值，按对齐到网格后的输入分解，合计与报价一致
+                        explain_age, explain_bmi, explain_children = age, bmi, children
+                        if quote_grid is not None:
+                            explain_age, explain_bmi, explain_children, _ = snap_to_grid(quote_grid, age, bmi, children)
+                        bias, contrib = explain_quote(rf_model, schema, model_signature(rf_model, schema),
+                                                      explain_age, sex, explain_bmi, explain_children, smoker, region)
+                        st.write(f"**基础费用（训练数据平均）**: ¥{bias:,.2f}")
+                        for feature, value in zip(schema.FEATURES, contrib):
+                            sign = '+' if value >= 0 else '-'
+                            st.write(f"**{FEATURE_LABELS[feature]}**: {sign}¥{abs(value):,.2f}")
+                        st.caption("由随机森林每棵树决策路径上的分裂逐项分解得到：基础费用 + 各项贡献 = 模型预测值")
+                        if quote_grid is not None and explain_bmi != bmi:
+                            st.caption(f"查表模式：BMI 按网格分辨率取 {explain_bmi:g} 进行报价和分解")
                     with st.expander("🌲 随机森林预测说明"):
                         st.markdown("""
                         随机森林是一种集成学习算法，具有以下特点：
@@ -403,6 +915,82 @@ def show_prediction():
             else:
                 st.error("请输入有效的年龄和BMI值")
 
+def show_batch_prediction():
+    """显示批量预测页面"""
+    st.markdown("## 批量预测")
+    st.markdown("""
+    上传与 `insurance-chinese.csv` 结构相同的CSV文件（年龄、性别、BMI、子女数量、是否吸烟、区域），
+    系统会使用与训练相同的编码方案一次性完成整张表的预测。
+    """)
+    
+    df, schema = load_and_preprocess_data()
+    rf_model = load_or_train_model(df, schema)[0] if SKLEARN_AVAILABLE else None
+    
+    uploaded_file = st.file_uploader("上传CSV文件", type=['csv'])
+    if uploaded_file is None:
+        return
+    
+    try:
+        batch_df = read_insurance_csv(uploaded_file)
+        predictions, model_name = predict_medical_cost_batch(batch_df, rf_model, schema)
+    except (KeyError, ValueError) as e:
+        st.error(f"❌ 批量预测失败: {e}")
+        return
+    
+    reverse_columns = {v: k for k, v in INSURANCE_COLUMNS.items()}
+    result = batch_df.rename(columns=reverse_columns)
+    result['预测医疗费用'] = np.round(predictions, 2)
+    if model_name == "随机森林" and st.checkbox("附加特征贡献分解列", value=True):
+        result = add_contribution_columns(result, batch_df, rf_model, schema)
+    
+    st.success(f"✅ 已完成 {len(result):,} 条预测（使用模型: {model_name}）")
+    
+    with st.expander("📈 输入分布漂移检测（相对训练数据）", expanded=True):
+        drift_report = compute_drift_report(get_drift_reference(df, schema), batch_df, schema)
+        st.dataframe(drift_report, use_container_width=True, hide_index=True)
+        if (drift_report['结论'] == "显著漂移").any():
+            st.warning("⚠️ 部分字段分布与训练数据差异明显，预测结果可能不可靠")
+        st.caption("PSI < 0.1 稳定，0.1–0.25 轻微漂移，> 0.25 显著漂移；KS 为两组累计分布的最大差值")
+    st.dataframe(result.head(100), use_container_width=True)
+    st.download_button(
+        "📥 下载预测结果",
+        data=result.to_csv(index=False).encode('utf-8-sig'),
+        file_name="batch_predictions.csv",
+        mime="text/csv"
+    )
+
+def show_rate_sheet():
+    """显示费率表页面"""
+    st.markdown("## 费率表")
+    st.markdown("""
+    一次性生成 年龄 × BMI区间 × 是否吸烟 × 性别 × 区域 × 子女数量 全部组合的预测费用，
+    导出为可打印的 Excel 工作簿。
+    """)
+    
+    if not OPENPYXL_AVAILABLE:
+        st.error("❌ 未安装 openpyxl，无法导出 Excel 费率表")
+        return
+    
+    df, schema = load_and_preprocess_data()
+    rf_model = load_or_train_model(df, schema)[0] if SKLEARN_AVAILABLE else None
+    
+    age_min, age_max = st.slider("年龄范围", min_value=18, max_value=80, value=(18, 80))
+    max_children = st.slider("最多子女数量", min_value=0, max_value=5, value=5)
+    n_rows = (age_max - age_min + 1) * len(BMI_BANDS) * len(SMOKER_OPTIONS) * len(SEX_OPTIONS) * len(REGION_OPTIONS) * (max_children + 1)
+    st.caption(f"共 {n_rows:,} 种组合，{n_rows * (len(RATE_SHEET_COLUMNS) + 1):,} 个单元格")
+    
+    if st.button("生成费率表"):
+        model_key = model_signature(rf_model, schema) if rf_model is not None else None
+        with st.spinner("正在批量预测并写出工作簿..."):
+            content, n_rows, model_name = build_rate_sheet_xlsx(rf_model, schema, model_key, age_min, age_max, max_children)
+        st.success(f"✅ 费率表已生成：{n_rows:,} 行（使用模型: {model_name}）")
+        st.download_button(
+            "📥 下载费率表",
+            data=content,
+            file_name="rate_sheet.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
+
 # ===================== 主应用 =====================
 def main():
     # 初始化session state
@@ -418,6 +1006,12 @@ def main():
     if st.sidebar.button("💰 预测分析", use_container_width=True):
         st.session_state.current_page = '预测分析'
     
+    if st.sidebar.button("📁 批量预测", use_container_width=True):
+        st.session_state.current_page = '批量预测'
+    
+    if st.sidebar.button("📑 费率表", use_container_width=True):
+        st.session_state.current_page = '费率表'
+    
     st.sidebar.markdown("---")
     st.sidebar.markdown(f"**当前页面**: {st.session_state.current_page}")
     
@@ -426,6 +1020,10 @@ def main():
         show_introduction()
     elif st.session_state.current_page == '预测分析':
         show_prediction()
+    elif st.session_state.current_page == '批量预测':
+        show_batch_prediction()
+    elif st.session_state.current_page == '费率表':
+        show_rate_sheet()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,80 @@
+"""
+企鹅分类器 —— 单条预测延迟基准测试
+
+在应用当前使用的模型（penguin_model.joblib 与 rfc_model.pkl 中修改时间较新的一份）上，
+用观测数据中的真实样本逐条调用 predict 与 predict_proba，比较 p50/p99/平均延迟，
+确认页面改用概率输出后单次请求的开销没有明显增加。
+
+用法：python penguin_benchmark.py [--repeat 2000] [--warmup 50]
+"""
+import argparse
+import os
+import pickle
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+ARTIFACT_PATH = 'penguin_model.joblib'
+MODEL_PATH = 'rfc_model.pkl'
+UNIQUES_PATH = 'output_uniques.pkl'
+DATA_PATH = 'penguins-chinese.csv'
+
+
+def load_shipped_model():
+    """与 ty11.py 的 get_model 一致：两种模型文件都存在时使用修改时间较新的一份"""
+    if os.path.exists(MODEL_PATH) and os.path.exists(UNIQUES_PATH):
+        pkl_mtime = max(os.path.getmtime(MODEL_PATH), os.path.getmtime(UNIQUES_PATH))
+        if not os.path.exists(ARTIFACT_PATH) or pkl_mtime > os.path.getmtime(ARTIFACT_PATH):
+            with open(MODEL_PATH, 'rb') as f:
+                return pickle.load(f), MODEL_PATH
+    return joblib.load(ARTIFACT_PATH, mmap_mode='r')['model'], ARTIFACT_PATH
+
+
+def load_samples(rfc_model):
+    """观测数据独热编码后按模型特征顺序排列，每条样本保留为单行 DataFrame（与页面输入一致）"""
+    df = pd.read_csv(DATA_PATH, encoding='gbk').dropna()
+    features = pd.get_dummies(df[['喙的长度', '喙的深度', '翅膀的长度', '身体质量', '企鹅栖息的岛屿', '性别']], dtype=int)
+    features = features.reindex(columns=rfc_model.feature_names_in_, fill_value=0)
+    return [features.iloc[[i]] for i in range(len(features))]
+
+
+def time_calls(func, samples, repeat, warmup):
+    """逐条调用 func，返回每次调用耗时（秒）"""
+    for i in range(warmup):
+        func(samples[i % len(samples)])
+    latencies = np.empty(repeat)
+    for i in range(repeat):
+        sample = samples[i % len(samples)]
+        start = time.perf_counter()
+        func(sample)
+        latencies[i] = time.perf_counter() - start
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="企鹅分类器 predict 与 predict_proba 单条延迟对比")
+    parser.add_argument('--repeat', type=int, default=2000, help="每种调用的采样次数")
+    parser.add_argument('--warmup', type=int, default=50, help="预热调用次数（不计入统计）")
+    args = parser.parse_args()
+
+    rfc_model, model_path = load_shipped_model()
+    samples = load_samples(rfc_model)
+
+    # 两种调用交替测量两轮，减少 CPU 频率和缓存状态带来的偏差
+    results = {'predict': [], 'predict_proba': []}
+    for _ in range(2):
+        results['predict'].append(time_calls(rfc_model.predict, samples, args.repeat, args.warmup))
+        results['predict_proba'].append(time_calls(rfc_model.predict_proba, samples, args.repeat, args.warmup))
+
+    print(f"模型：{model_path}（{rfc_model.n_estimators} 棵树，n_jobs={rfc_model.n_jobs}），每种调用 {2 * args.repeat} 次")
+    print(f"{'调用':<16}{'p50(ms)':>10}{'p99(ms)':>10}{'平均(ms)':>10}")
+    for name, runs in results.items():
+        latencies = np.concatenate(runs) * 1000
+        print(f"{name:<16}{np.percentile(latencies, 50):>10.3f}{np.percentile(latencies, 99):>10.3f}"
+              f"{latencies.mean():>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+超市销售数据 —— 日销售额预测（Holt-Winters）
+
+每个 城市×产品类型 的日销售额序列单独拟合一个加法趋势 + 7天季节的 Holt-Winters 模型。
+拟合在后台进程池中进行（statsmodels 优化是 CPU 密集型），结果按“序列内容哈希”缓存：
+进程内存一份，artifacts/sales_forecast/<哈希>.json 一份，重启后也能直接显示；
+只有数据变化的序列才会重新拟合。
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from app_utils import write_json_atomic
+
+try:
+    from statsmodels.tsa.holtwinters import ExponentialSmoothing
+    STATSMODELS_AVAILABLE = True
+except ImportError:
+    STATSMODELS_AVAILABLE = False
+
+FORECAST_CACHE_DIR = os.path.join('artifacts', 'sales_forecast')
+# 预先算好的最大预测天数，页面上按需截取
+MAX_HORIZON = 56
+SEASONAL_PERIODS = 7
+# 少于该天数时趋势模型参数多于数据，退化为只有水平项的简单指数平滑
+MIN_TREND_POINTS = 10
+# 拟合逻辑变化时递增，旧的缓存结果自动失效
+FORECAST_VERSION = 2
+
+
+# ===================== 单个序列拟合（进程池任务） =====================
+def series_digest(values, start):
+    """序列版本：起始日期 + 每日数值的哈希"""
+    digest = hashlib.sha256(f"{pd.Timestamp(start).date()}|v{FORECAST_VERSION}".encode('utf-8'))
+    digest.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    return digest.hexdigest()[:20]
+
+
+def fit_forecast(values, start, horizon=MAX_HORIZON, seasonal_periods=SEASONAL_PERIODS):
+    """拟合一个日销售额序列并预测 horizon 天：
+    数据不足两个季节周期时去掉季节项，不足 MIN_TREND_POINTS 天时只保留水平项，只有1天时按该值持平预测"""
+    series = pd.Series(np.asarray(values, dtype=float),
+                       index=pd.date_range(start, periods=len(values), freq='D'))
+    forecast_index = pd.date_range(series.index[-1] + pd.Timedelta(days=1), periods=horizon, freq='D')
+    if len(series) < 2:
+        return {
+            'model': '持平预测（数据不足）',
+            'params': {},
+            'sse': 0.0,
+            'forecast_start': str(forecast_index[0].date()),
+            'forecast': [round(float(series.iloc[-1]), 2)] * horizon,
+        }
+
+    has_trend = len(series) >= MIN_TREND_POINTS
+    seasonal = 'add' if len(series) >= 2 * seasonal_periods else None
+    with warnings.catch_warnings():
+        # 短序列/零值较多时优化器常给出收敛提示，不影响预测
+        warnings.simplefilter('ignore')
+        model = ExponentialSmoothing(series, trend='add' if has_trend else None,
+                                     damped_trend=has_trend, seasonal=seasonal,
+                                     seasonal_periods=seasonal_periods if seasonal else None,
+                                     initialization_method='estimated')
+        fitted = model.fit()
+    forecast = fitted.forecast(horizon).clip(lower=0)
+    params = {name: float(value) for name, value in fitted.params.items()
+              if np.isscalar(value) and np.isfinite(value)}
+    if not has_trend:
+        model_name = '简单指数平滑（数据较少）'
+    else:
+        model_name = 'Holt-Winters' + ('（7天季节）' if seasonal else '')
+    return {
+        'model': model_name,
+        'params': params,
+        'sse': float(fitted.sse),
+        'forecast_start': str(forecast.index[0].date()),
+        'forecast': [round(float(v), 2) for v in forecast],
+    }
+
+
+# ===================== 后台拟合与缓存 =====================
+class ForecastManager:
+    """管理后台拟合：按序列哈希缓存结果，未缓存的序列提交到进程池，同一哈希只提交一次"""
+
+    def __init__(self, cache_dir=FORECAST_CACHE_DIR, max_workers=None):
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.results = {}
+        self.pending = {}
+        self.errors = {}
+        self._pool = None
+
+    def _cache_path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.json")
+
+    def _load_cached(self, digest):
+        path = self._cache_path(digest)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        return None
+
+    def _on_done(self, digest, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            with self.lock:
+                self.pending.pop(digest, None)
+                self.errors[digest] = str(e)
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        write_json_atomic(self._cache_path(digest), result)
+        with self.lock:
+            self.pending.pop(digest, None)
+            self.results[digest] = result
+
+    def request(self, series_map):
+        """series_map 为 {序列名: 按日索引的 Series}（各序列可以有不同的起止日期）；返回 {序列名: 拟合结果}，
+        仍在拟合的序列为 None，拟合失败的序列为 {'error': 错误信息}（不会重复提交）；
+        缺少结果的序列提交到进程池"""
+        found = {}
+        to_fit = {}
+        for name, series in series_map.items():
+            start, values = series.index[0], series.to_numpy(dtype=float)
+            digest = series_digest(values, start)
+            with self.lock:
+                result = self.results.get(digest)
+                error = self.errors.get(digest)
+                queued = digest in self.pending
+            if error is not None:
+                found[name] = {'error': error}
+                continue
+            if result is None and not queued:
+                result = self._load_cached(digest)
+                if result is not None:
+                    with self.lock:
+                        self.results[digest] = result
+                else:
+                    to_fit[digest] = (values, start)
+            found[name] = result
+
+        if to_fit:
+            with self.lock:
+                if self._pool is None:
+                    # 在多线程的 Streamlit 服务器中 fork 可能继承其他线程持有的锁，改用 spawn
+                    self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                for digest, (values, start) in to_fit.items():
+                    future = self._pool.submit(fit_forecast, values, start)
+                    self.pending[digest] = future
+                    future.add_done_callback(lambda f, digest=digest: self._on_done(digest, f))
+        return found
+
+    @property
+    def pending_count(self):
+        with self.lock:
+            return len(self.pending)
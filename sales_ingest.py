@@ -0,0 +1,253 @@
+"""
+超市销售数据 —— Excel 导入缓存
+
+openpyxl 解析工作簿是整个加载流程中最慢的一步。这里把工作表只解析一次，
+转换为标准英文列名（含解析后的 date 和整数 hour）并写成 Parquet，
+之后按“文件大小 + 修改时间 + 内容哈希”复用，跨进程、跨重启有效。
+
+目录加载（load_sales_directory）：发现目录下所有工作簿，未缓存的在进程池中并行解析
+（openpyxl 是纯 Python、受 GIL 限制），按订单号去重后合并为一张带 source_file 列的表。
+
+缓存目录结构（artifacts/sales_cache/）：
+  - <内容哈希>_v<版本>.parquet   标准化后的销售表（time 列解析为 int8 的 hour/minute 和 time_invalid 标记）
+  - sources/<路径哈希>.json      源文件的大小、修改时间和内容哈希
+"""
+import datetime
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from app_utils import write_atomic, write_json_atomic
+
+SALES_CACHE_DIR = os.path.join('artifacts', 'sales_cache')
+# 销售工作簿所在目录，可用环境变量 SALES_DATA_DIR 配置
+SALES_DATA_DIR = os.environ.get('SALES_DATA_DIR', '.')
+# 标准化逻辑变化时递增，旧版本的 Parquet 自动失效
+INGEST_VERSION = 3
+
+# Excel 列名 → 标准英文列名
+SALES_COLUMNS = {
+    "订单号": "order_id",
+    "分店": "branch",
+    "城市": "city",
+    "顾客类型": "customer_type",
+    "性别": "gender",
+    "产品类型": "category",
+    "单价": "unit_price",
+    "数量": "quantity",
+    "总价": "revenue",  # "总价"即销售额
+    "日期": "date",
+    "时间": "time",
+    "评分": "rating",
+}
+# 数值列固定类型：只有整数评分/单价的工作簿也与其他分区类型一致，才能合并
+NUMERIC_DTYPES = {
+    "unit_price": "float64",
+    "quantity": "int64",
+    "revenue": "float64",
+    "rating": "float64",
+}
+
+
+# ===================== 时间列解析 =====================
+# 去掉非数字/冒号字符后匹配 H:MM、HH:MM 或 HH:MM:SS
+TIME_PATTERN = r'^(?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?$'
+
+
+def _parse_time_objects(values):
+    """datetime.time 单元格：转为 Arrow time64 后直接取时/分"""
+    arr = pa.array(values, type=pa.time64('us'), from_pandas=True)
+    return pc.hour(arr), pc.minute(arr)
+
+
+def _parse_time_strings(values):
+    """字符串单元格：Arrow 正则一次性清理和提取，并检查取值范围"""
+    arr = pa.array(values, type=pa.string(), from_pandas=True)
+    parts = pc.extract_regex(pc.replace_substring_regex(arr, r'[^\d:]', ''), TIME_PATTERN)
+    # struct_field 会把未匹配行（结构体为空）传播为空值
+    hour = pc.cast(pc.struct_field(parts, 'hour'), pa.int16())
+    minute = pc.cast(pc.struct_field(parts, 'minute'), pa.int16())
+    second_text = pc.struct_field(parts, 'second')
+    second = pc.cast(pc.if_else(pc.equal(second_text, ''), '0', second_text), pa.int16())
+    in_range = pc.and_(pc.and_(pc.less(hour, 24), pc.less(minute, 60)), pc.less(second, 60))
+    return pc.if_else(in_range, hour, None), pc.if_else(in_range, minute, None)
+
+
+def parse_time_column(values):
+    """向量化解析时间列，返回 (hour, minute, invalid)：hour/minute 为 int8，无效值填 0，
+    invalid 为无效值掩码。支持 datetime.time 单元格、"HH:MM" / "HH:MM:SS" 字符串及两者混合"""
+    values = pd.Series(values).reset_index(drop=True)
+    hour = np.zeros(len(values), dtype=np.int8)
+    minute = np.zeros(len(values), dtype=np.int8)
+    invalid = np.ones(len(values), dtype=bool)
+
+    def fill(positions, parsed):
+        parsed_hour, parsed_minute = parsed
+        valid = pc.is_valid(parsed_hour).to_numpy(zero_copy_only=False)
+        hour[positions[valid]] = parsed_hour.drop_null().to_numpy()
+        minute[positions[valid]] = pc.filter(parsed_minute, pc.is_valid(parsed_hour)).to_numpy()
+        invalid[positions[valid]] = False
+
+    if pd.api.types.is_datetime64_any_dtype(values):
+        valid = values.notna().to_numpy()
+        hour[valid] = values.dt.hour[valid]
+        minute[valid] = values.dt.minute[valid]
+        invalid[valid] = False
+        return hour, minute, invalid
+
+    # 按单元格类型分组：time 对象和字符串各自整列解析，其余（数字等）转为字符串再解析
+    kinds = values.map(type)
+    is_time = (kinds == datetime.time).to_numpy()
+    is_str = (kinds == str).to_numpy()
+    is_other = ~(is_time | is_str) & values.notna().to_numpy()
+    if is_time.any():
+        fill(np.flatnonzero(is_time), _parse_time_objects(values[is_time]))
+    if is_str.any():
+        fill(np.flatnonzero(is_str), _parse_time_strings(values[is_str]))
+    if is_other.any():
+        fill(np.flatnonzero(is_other), _parse_time_strings(values[is_other].astype(str)))
+    return hour, minute, invalid
+
+
+# ===================== 解析工作簿 =====================
+def read_sales_workbook(path):
+    """用 openpyxl 解析工作簿并标准化（慢，只在缓存未命中时调用）"""
+    # 跳过第一行（"2022年前3个月销售数据"），用第二行做列名
+    df = pd.read_excel(path, engine="openpyxl", header=1)
+    return standardize_sales_frame(df)
+
+
+def standardize_sales_frame(df):
+    """列名映射为英文，数值列转为固定类型，时间列解析为小时/分钟，转换日期列"""
+    df = df.rename(columns=SALES_COLUMNS)
+    for column, dtype in NUMERIC_DTYPES.items():
+        if column in df.columns:
+            # 非数字单元格记为空值；数量列用可空整数，空单元格不会把整列变成浮点
+            values = pd.to_numeric(df[column], errors="coerce")
+            df[column] = values.astype("Int64" if dtype == "int64" else dtype)
+
+    # 时间列容错：无法识别的时间小时/分钟记为0，并在 time_invalid 中标记
+    hour, minute, invalid = parse_time_column(df.pop("time"))
+    df["hour"] = hour
+    df["minute"] = minute
+    df["time_invalid"] = invalid
+
+    df["date"] = pd.to_datetime(df["date"], errors="coerce")
+    return df
+
+
+# ===================== Parquet 缓存 =====================
+def file_digest(path):
+    """源文件内容的 SHA-256（分块读取，不把整个文件读入内存）"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_record_path(path, cache_dir):
+    key = hashlib.sha256(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, 'sources', f"{key}.json")
+
+
+def cached_parquet_path(path, cache_dir=SALES_CACHE_DIR):
+    """返回源文件对应的 Parquet 缓存路径：
+    大小和修改时间都没变时直接使用记录的内容哈希；否则重新计算哈希
+    （文件被复制或只是修改时间变化时，内容相同仍然命中同一个 Parquet）"""
+    stat = os.stat(path)
+    record_path = _source_record_path(path, cache_dir)
+    record = None
+    if os.path.exists(record_path):
+        with open(record_path, encoding='utf-8') as f:
+            record = json.load(f)
+    if not record or record['size'] != stat.st_size or record['mtime_ns'] != stat.st_mtime_ns:
+        record = {
+            'path': os.path.abspath(path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': file_digest(path),
+        }
+        os.makedirs(os.path.dirname(record_path), exist_ok=True)
+        write_json_atomic(record_path, record)
+    return os.path.join(cache_dir, f"{record['sha256'][:16]}_v{INGEST_VERSION}.parquet")
+
+
+def load_sales_workbook(path, cache_dir=SALES_CACHE_DIR):
+    """读取一个销售工作簿：命中缓存时直接读 Parquet，否则解析 Excel 并写入缓存；
+    返回 (标准化后的 DataFrame, 是否命中缓存)"""
+    parquet_path = cached_parquet_path(path, cache_dir)
+    if os.path.exists(parquet_path):
+        return pd.read_parquet(parquet_path), True
+
+    df = read_sales_workbook(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    write_atomic(parquet_path, lambda tmp_path: df.to_parquet(tmp_path, index=False))
+    return df, False
+
+
+def ensure_parquet(path, cache_dir=SALES_CACHE_DIR):
+    """确保工作簿已转换为 Parquet 缓存并返回缓存路径（进程池任务，须为模块级函数）"""
+    parquet_path = cached_parquet_path(path, cache_dir)
+    if not os.path.exists(parquet_path):
+        load_sales_workbook(path, cache_dir)
+    return parquet_path
+
+
+# ===================== 目录加载 =====================
+def discover_workbooks(directory=SALES_DATA_DIR):
+    """目录下的所有 .xlsx 工作簿（跳过 Excel 打开文件时生成的 ~$ 临时文件），按修改时间排序"""
+    paths = [path for path in glob.glob(os.path.join(directory, '*.xlsx'))
+             if not os.path.basename(path).startswith('~$')]
+    return sorted(paths, key=lambda path: (os.path.getmtime(path), path))
+
+
+def read_partition(path, parquet_path):
+    """读取一个工作簿的 Parquet 缓存，并追加字典编码的 source_file 分区列"""
+    table = pq.read_table(parquet_path)
+    source = pa.DictionaryArray.from_arrays(
+        pa.array(np.zeros(table.num_rows, dtype=np.int32)), pa.array([os.path.basename(path)]))
+    return table.append_column('source_file', source)
+
+
+def combine_partitions(tables):
+    """合并各工作簿的表并按订单号去重（重复时保留较新工作簿中的记录）"""
+    # 各分区的字典不同，先统一字典再合并
+    table = pa.concat_tables(tables, promote_options='default').unify_dictionaries()
+    df = table.to_pandas()
+    if 'order_id' in df.columns:
+        df = df.drop_duplicates(subset='order_id', keep='last', ignore_index=True)
+    return df
+
+
+def load_sales_directory(directory=SALES_DATA_DIR, max_workers=None, cache_dir=SALES_CACHE_DIR):
+    """加载目录下所有工作簿：未缓存的工作簿在进程池中并行解析，其余直接读取 Parquet；
+    返回 (合并去重后的 DataFrame, 工作簿路径列表)"""
+    paths = discover_workbooks(directory)
+    if not paths:
+        return pd.DataFrame(), []
+
+    parquet_paths = {path: cached_parquet_path(path, cache_dir) for path in paths}
+    # 内容相同的工作簿共用同一个缓存文件，只解析一次
+    missing = list({parquet_paths[path]: path for path in reversed(paths)
+                    if not os.path.exists(parquet_paths[path])}.values())
+    if len(missing) > 1:
+        # Streamlit 服务器是多线程进程，fork 出的子进程可能继承被其他线程持有的锁，改用 spawn
+        with ProcessPoolExecutor(max_workers=min(max_workers or os.cpu_count() or 1, len(missing)),
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            list(pool.map(ensure_parquet, missing, [cache_dir] * len(missing)))
+    else:
+        for path in missing:
+            ensure_parquet(path, cache_dir)
+
+    tables = [read_partition(path, parquet_paths[path]) for path in paths]
+    return combine_partitions(tables), paths
@@ -7,6 +7,7 @@ from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import OneHotEncoder
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
+from image_assets import show_image
 
 # ---------------------- 全局配置：隐藏默认导航+黑色背景样式 ----------------------
 # 1. 页面基础配置（宽屏+折叠默认侧边栏）
@@ -232,7 +233,7 @@ def page_project_overview():
         """)
 
     with col_img:
-        st.image("images/rigth.jpg", caption="系统核心功能预览", use_container_width=True)
+        show_image("images/rigth.jpg", caption="系统核心功能预览")
     
     st.divider()
 
@@ -558,9 +559,9 @@ def page_grade_prediction():
             with image_placeholder.container():
                 try:
                     if is_passed:
-                        st.image("images/tg.jpg", caption="考试通过！继续加油~", width=400)
+                        show_image("images/tg.jpg", caption="考试通过！继续加油~", width=400)
                     else:
-                        st.image("images/wtg.jpg", caption="未通过，调整学习计划哦~", width=400)
+                        show_image("images/wtg.jpg", caption="未通过，调整学习计划哦~", width=400)
                 except Exception as e:
                     st.warning(f"图片加载失败：{e}\n提示：请将图片放在 images/ 目录下，命名为 tg.jpg（通过）和 wtg.jpg（未通过）")
 
@@ -0,0 +1,112 @@
+"""
+企鹅分类器 —— 可复现的模型训练流程
+
+读取 GBK 编码的 penguins-chinese.csv，用中位数填补缺失的测量值，独热编码岛屿和性别，
+并行训练随机森林（袋外样本评估准确率），输出：
+  - penguin_model.joblib   模型 + 类别映射（默认不压缩，可用 mmap_mode='r' 加载）
+  - penguin_model.json     清单：特征名、类别映射、填补值、评估指标、训练耗时
+  - rfc_model.pkl / output_uniques.pkl  ty11.py 原有的模型文件格式
+
+用法：python train_penguin_model.py [--n-estimators 100] [--compress 0]
+"""
+import argparse
+import os
+import pickle
+import time
+from datetime import datetime
+
+import joblib
+import pandas as pd
+import sklearn
+from sklearn.ensemble import RandomForestClassifier
+
+from app_utils import write_atomic, write_json_atomic
+
+DATA_PATH = 'penguins-chinese.csv'
+TARGET = '企鹅的种类'
+NUMERIC_FEATURES = ['喙的长度', '喙的深度', '翅膀的长度', '身体质量']
+CATEGORICAL_FEATURES = ['企鹅栖息的岛屿', '性别']
+
+
+def load_training_data(path=DATA_PATH):
+    """读取数据，数值列缺失值用中位数填补；返回 (特征, 类别代码, 类别映射, 填补值)"""
+    df = pd.read_csv(path, encoding='gbk')
+    df = df.dropna(subset=[TARGET])
+
+    fill_values = df[NUMERIC_FEATURES].median().round(2).to_dict()
+    df[NUMERIC_FEATURES] = df[NUMERIC_FEATURES].fillna(fill_values)
+
+    # 独热编码（取值按字典序排列，与 rfc_model.feature_names_in_ 的列顺序一致）
+    features = pd.get_dummies(df[NUMERIC_FEATURES + CATEGORICAL_FEATURES], dtype=int)
+    target, output_uniques = pd.factorize(df[TARGET])
+    return features, target, output_uniques, fill_values
+
+
+def train(features, target, n_estimators=100, random_state=42):
+    """并行训练随机森林，袋外(OOB)样本直接给出准确率"""
+    start = time.perf_counter()
+    rfc_model = RandomForestClassifier(n_estimators=n_estimators, random_state=random_state,
+                                       n_jobs=-1, oob_score=True)
+    rfc_model.fit(features, target)
+    fit_seconds = time.perf_counter() - start
+    # 训练时并行；应用中单条预测不需要线程池调度开销
+    rfc_model.set_params(n_jobs=None)
+    metrics = {'oob_accuracy': round(float(rfc_model.oob_score_), 4), 'n_samples': int(len(target))}
+    return rfc_model, metrics, fit_seconds
+
+
+def _write_pickle(obj):
+    def write(tmp_path):
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(obj, f)
+    return write
+
+
+def save_outputs(out_dir, rfc_model, output_uniques, fill_values, metrics, fit_seconds, compress=0):
+    """写出 pkl 文件、joblib 模型和清单文件（清单最后写出）；
+    ty11.py 使用修改时间较新的模型文件，joblib 在 pkl 之后写出，训练后使用 joblib 模型。
+    运行中的 ty11.py 可能以内存映射方式打开着旧模型，所有文件都原地替换而不是覆盖"""
+    os.makedirs(out_dir, exist_ok=True)
+    write_atomic(os.path.join(out_dir, 'rfc_model.pkl'), _write_pickle(rfc_model))
+    write_atomic(os.path.join(out_dir, 'output_uniques.pkl'), _write_pickle(output_uniques))
+    artifact_path = os.path.join(out_dir, 'penguin_model.joblib')
+    # 压缩后的文件无法内存映射加载，默认不压缩
+    write_atomic(artifact_path, lambda tmp_path: joblib.dump(
+        {'model': rfc_model, 'output_uniques': output_uniques}, tmp_path, compress=compress))
+
+    manifest = {
+        'artifact': os.path.basename(artifact_path),
+        'compressed': bool(compress),
+        'feature_names': list(rfc_model.feature_names_in_),
+        'class_map': {int(code): output_uniques[code] for code in rfc_model.classes_},
+        'fill_values': fill_values,
+        'metrics': metrics,
+        'fit_seconds': round(fit_seconds, 4),
+        'params': {k: v for k, v in rfc_model.get_params().items() if isinstance(v, (int, float, str, bool, type(None)))},
+        'trained_at': datetime.now().isoformat(timespec='seconds'),
+        'sklearn_version': sklearn.__version__,
+    }
+    write_json_atomic(os.path.join(out_dir, 'penguin_model.json'), manifest, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="训练企鹅分类随机森林模型")
+    parser.add_argument('--data', default=DATA_PATH, help="训练数据（GBK 编码CSV）")
+    parser.add_argument('--out-dir', default='.', help="输出目录（默认与 ty11.py 同目录）")
+    parser.add_argument('--n-estimators', type=int, default=100, help="树的数量")
+    parser.add_argument('--random-state', type=int, default=42, help="随机数种子")
+    parser.add_argument('--compress', type=int, default=0,
+                        help="joblib 压缩级别 0-9（大于 0 时文件更小，但不能内存映射加载）")
+    args = parser.parse_args()
+
+    features, target, output_uniques, fill_values = load_training_data(args.data)
+    rfc_model, metrics, fit_seconds = train(features, target, args.n_estimators, args.random_state)
+    manifest = save_outputs(args.out_dir, rfc_model, output_uniques, fill_values,
+                            metrics, fit_seconds, args.compress)
+    print(f"训练完成：{metrics['n_samples']} 条样本，OOB 准确率 {metrics['oob_accuracy']:.4f}，"
+          f"耗时 {manifest['fit_seconds']:.2f} 秒 → {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
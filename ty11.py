@@ -1,6 +1,17 @@
 import streamlit as st
 import pickle
+import joblib
 import pandas as pd
+import numpy as np
+import os
+import time
+from datetime import datetime
+from image_assets import show_image
+try:
+    from scipy.spatial import cKDTree
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
 
 # 设置页面配置
 st.set_page_config(
@@ -9,11 +20,155 @@ st.set_page_config(
     layout="wide",
 )
 
+# 模型文件路径
+MODEL_PATH = 'rfc_model.pkl'
+UNIQUES_PATH = 'output_uniques.pkl'
+# train_penguin_model.py 生成的模型文件；与 pkl 文件同时存在时使用修改时间较新的一份
+ARTIFACT_PATH = 'penguin_model.joblib'
+# 相似企鹅检索使用的观测数据和特征
+DATA_PATH = 'penguins-chinese.csv'
+SIMILARITY_FEATURES = ['喙的长度', '喙的深度', '翅膀的长度', '身体质量']
+# 概率展示的类别数，以及低于该置信度时提示人工复核
+TOP_K = 3
+DEFAULT_REVIEW_THRESHOLD = 0.6
+
+
+@st.cache_resource(max_entries=1)
+def load_model(model_mtime, uniques_mtime):
+    """加载模型和类别映射，每个进程只反序列化一次；
+    两个文件的修改时间作为缓存键，替换pkl文件后下次运行自动热加载"""
+    start = time.perf_counter()
+    with open(MODEL_PATH, 'rb') as f:
+        rfc_model = pickle.load(f)
+    with open(UNIQUES_PATH, 'rb') as f:
+        output_uniques_map = pickle.load(f)
+    load_info = {
+        'seconds': time.perf_counter() - start,
+        'loaded_at': datetime.now().strftime('%H:%M:%S'),
+        'source': MODEL_PATH,
+    }
+    return rfc_model, output_uniques_map, load_info
+
+
+@st.cache_resource(max_entries=1)
+def load_model_artifact(artifact_mtime):
+    """以内存映射方式加载 joblib 模型文件（未压缩时数组直接映射，无需解压和整体读入）"""
+    start = time.perf_counter()
+    artifact = joblib.load(ARTIFACT_PATH, mmap_mode='r')
+    load_info = {
+        'seconds': time.perf_counter() - start,
+        'loaded_at': datetime.now().strftime('%H:%M:%S'),
+        'source': ARTIFACT_PATH,
+    }
+    return artifact['model'], artifact['output_uniques'], load_info
+
+
+def get_model():
+    """按当前文件修改时间获取模型（命中缓存时无需任何反序列化）：
+    joblib 模型文件与 pkl 文件都存在时使用较新的一份，直接替换 pkl 文件同样会热加载"""
+    if os.path.exists(MODEL_PATH) and os.path.exists(UNIQUES_PATH):
+        model_mtime, uniques_mtime = os.path.getmtime(MODEL_PATH), os.path.getmtime(UNIQUES_PATH)
+        if not os.path.exists(ARTIFACT_PATH) or max(model_mtime, uniques_mtime) > os.path.getmtime(ARTIFACT_PATH):
+            return load_model(model_mtime, uniques_mtime)
+    return load_model_artifact(os.path.getmtime(ARTIFACT_PATH))
+
+
+@st.cache_resource(max_entries=1)
+def build_similarity_index(data_mtime):
+    """用标准化后的喙/翅膀/体重特征构建 KD 树，只在观测数据文件变化时重建"""
+    observed = pd.read_csv(DATA_PATH, encoding='gbk').dropna(subset=SIMILARITY_FEATURES).reset_index(drop=True)
+    values = observed[SIMILARITY_FEATURES].to_numpy(dtype=float)
+    mean, std = values.mean(axis=0), values.std(axis=0)
+    return {'tree': cKDTree((values - mean) / std), 'mean': mean, 'std': std, 'data': observed}
+
+
+def get_similarity_index():
+    return build_similarity_index(os.path.getmtime(DATA_PATH))
+
+
+def find_similar_penguins(index, measurements, k=5):
+    """批量查询最相似的已观测企鹅：measurements 为 (n, 4) 数组（顺序同 SIMILARITY_FEATURES），
+    返回形状均为 (n, k) 的 (标准化距离, 观测数据行号)"""
+    query = (np.atleast_2d(np.asarray(measurements, dtype=float)) - index['mean']) / index['std']
+    k = min(k, len(index['data']))
+    distances, rows = index['tree'].query(query, k=k)
+    return distances.reshape(len(query), k), rows.reshape(len(query), k)
+
+
+def category_values(feature_names):
+    """从独热列名（“列名_取值”）还原训练时见过的各类别取值：{列名: [取值, ...]}"""
+    categories = {}
+    for name in feature_names:
+        if '_' in name:
+            column, value = name.rsplit('_', 1)
+            categories.setdefault(column, []).append(value)
+    return categories
+
+
+def unknown_category_mask(df, feature_names):
+    """类别列取值不在训练数据中的行（空值不算：训练数据中性别缺失的样本同样编码为全0）"""
+    unknown = pd.Series(False, index=df.index)
+    for column, values in category_values(feature_names).items():
+        unknown |= df[column].notna() & ~df[column].isin(values)
+    return unknown
+
+
+def build_feature_matrix(df, feature_names):
+    """按模型的 feature_names_in_ 向量化构造特征矩阵：
+    数值列直接取值，形如“列名_取值”的独热列整列比较得到 0/1；
+    类别取值未在训练数据中出现的行整行记为空值，不会被当作全0的独热编码去预测"""
+    features = {}
+    for name in feature_names:
+        if name in df.columns:
+            features[name] = pd.to_numeric(df[name], errors='coerce')
+        else:
+            column, value = name.rsplit('_', 1)
+            features[name] = (df[column] == value).astype(int)
+    X = pd.DataFrame(features, columns=feature_names, index=df.index)
+    X[unknown_category_mask(df, feature_names).to_numpy()] = np.nan
+    return X
+
+
+def read_penguin_csv(source):
+    """读取与 penguins-chinese.csv 同结构的CSV（自动识别编码）"""
+    for encoding in ['utf-8', 'gbk', 'utf-8-sig']:
+        try:
+            source.seek(0)
+            return pd.read_csv(source, encoding=encoding)
+        except UnicodeDecodeError:
+            continue
+    raise ValueError("无法识别文件编码")
+
+
+def classify_batch(df, rfc_model, output_uniques_map, chunk_size=10000, review_threshold=DEFAULT_REVIEW_THRESHOLD):
+    """批量分类：每块调用一次 predict_proba，返回物种名称、置信度、是否需人工复核和各物种概率；
+    测量值缺失（“数据缺失”）或岛屿/性别取值未知（“未知类别”）的行不参与预测"""
+    X = build_feature_matrix(df, rfc_model.feature_names_in_)
+    unknown = unknown_category_mask(df, rfc_model.feature_names_in_).to_numpy()
+    valid = X.notna().all(axis=1).to_numpy()
+    species_names = [output_uniques_map[code] for code in rfc_model.classes_]
+    proba = pd.DataFrame(float('nan'), index=df.index, columns=[f'概率_{name}' for name in species_names])
+
+    X_valid = X[valid]
+    for start in range(0, len(X_valid), chunk_size):
+        chunk = X_valid.iloc[start:start + chunk_size]
+        proba.loc[chunk.index] = rfc_model.predict_proba(chunk)
+
+    result = df.copy()
+    result['预测物种'] = np.where(unknown, '未知类别', '数据缺失')
+    if valid.any():
+        best = proba[valid].to_numpy().argmax(axis=1)
+        result.loc[valid, '预测物种'] = [species_names[i] for i in best]
+    result['置信度'] = proba.max(axis=1).round(4)
+    result['需人工复核'] = result['置信度'] < review_threshold
+    return pd.concat([result, proba.round(4)], axis=1)
+
+
 # 侧边栏（多页面选择）
 with st.sidebar:
-    st.image('images/rigth_logo.png', width=100)
+    show_image('images/rigth_logo.png', width=100)
     st.title('请选择页面')
-    page = st.selectbox("请选择页面", ["简介页面", "预测分类页面"], label_visibility='collapsed')
+    page = st.selectbox("请选择页面", ["简介页面", "预测分类页面", "批量分类页面"], label_visibility='collapsed')
 
 # 简介页面
 if page == "简介页面":
@@ -23,7 +178,7 @@ if page == "简介页面":
 该数据集由Gorman等收集，发布在R语言包`palmerpenguins`中，用于南极企鹅种类的分类研究。
 数据集包含344行观测数据，涵盖3个物种：阿德利企鹅、巴布亚企鹅、帽带企鹅的信息。""")
     st.header('三种企鹅的卡通图像')
-    st.image('images/penguins.png')
+    show_image('images/penguins.png')
 
 # 预测分类页面
 elif page == "预测分类页面":
@@ -43,45 +198,96 @@ elif page == "预测分类页面":
             body_mass = st.number_input('身体质量（克）', min_value=0.0)
             submitted = st.form_submit_button('预测分类')
 
-    # 岛屿特征独热编码（匹配训练时的格式）
-    island_biscoe, island_dream, island_torgerson = 0, 0, 0
-    if island == '比斯科群岛':
-        island_biscoe = 1
-    elif island == '德里姆岛':
-        island_dream = 1
-    elif island == '托尔森岛':
-        island_torgerson = 1
-
-    # 性别特征独热编码（匹配训练时的格式）
-    sex_female, sex_male = 0, 0
-    if sex == '雌性':
-        sex_female = 1
-    elif sex == '雄性':
-        sex_male = 1
-
-    # 整理输入数据格式
-    format_data = [bill_length, bill_depth, flipper_length, body_mass,
-                   island_dream, island_torgerson, island_biscoe, sex_male, sex_female]
-
-    # 加载训练好的模型和类别映射
-    with open('rfc_model.pkl', 'rb') as f:
-        rfc_model = pickle.load(f)
-    with open('output_uniques.pkl', 'rb') as f:
-        output_uniques_map = pickle.load(f)
+    # 整理输入数据格式（列名与 penguins-chinese.csv 一致）
+    input_df = pd.DataFrame({
+        '企鹅栖息的岛屿': [island], '性别': [sex],
+        '喙的长度': [bill_length], '喙的深度': [bill_depth],
+        '翅膀的长度': [flipper_length], '身体质量': [body_mass],
+    })
+
+    # 加载训练好的模型和类别映射（进程内缓存，模型文件更新时自动重新加载）
+    rfc_model, output_uniques_map, load_info = get_model()
+    with st.sidebar:
+        review_threshold = st.slider('人工复核置信度阈值', 0.0, 1.0, DEFAULT_REVIEW_THRESHOLD, 0.05)
+        st.caption(f"模型 {load_info['source']} 加载于 {load_info['loaded_at']}，耗时 {load_info['seconds'] * 1000:.1f} 毫秒")
 
     # 提交后执行预测
     if submitted:
-        # 转换为模型要求的DataFrame格式
-        format_data_df = pd.DataFrame(data=[format_data], columns=rfc_model.feature_names_in_)
-        # 预测类别代码
-        predict_result_code = rfc_model.predict(format_data_df)
+        # 独热编码并转换为模型要求的DataFrame格式（与批量分类共用同一编码）
+        format_data_df = build_feature_matrix(input_df, rfc_model.feature_names_in_)
+        if format_data_df.isna().any(axis=None):
+            st.error('岛屿或性别取值不在模型的训练数据中，无法预测')
+            st.stop()
+        # 预测各类别概率（predict 内部同样计算概率，直接取 predict_proba 不增加开销）
+        proba = rfc_model.predict_proba(format_data_df)[0]
+        order = np.argsort(proba)[::-1]
         # 映射为物种名称
-        predict_result_species = output_uniques_map[predict_result_code[0]]
-        st.write(f'根据您输入的数据，预测该企鹅的物种名称是：**{predict_result_species}**')
+        species_names = [output_uniques_map[code] for code in rfc_model.classes_]
+        predict_result_species = species_names[order[0]]
+        confidence = proba[order[0]]
+        st.write(f'根据您输入的数据，预测该企鹅的物种名称是：**{predict_result_species}**（置信度 {confidence:.0%}）')
+        with col_form:
+            top_k_df = pd.DataFrame({
+                '物种': [species_names[i] for i in order[:TOP_K]],
+                '概率': proba[order[:TOP_K]].round(4),
+            })
+            st.dataframe(top_k_df, hide_index=True, use_container_width=True)
+            if confidence < review_threshold:
+                st.warning(f'置信度低于 {review_threshold:.0%}，建议人工复核该样本')
+
+        # 最相似的已观测企鹅（KD 树最近邻）
+        if SCIPY_AVAILABLE:
+            similarity_index = get_similarity_index()
+            distances, rows = find_similar_penguins(
+                similarity_index, [[bill_length, bill_depth, flipper_length, body_mass]], k=5)
+            similar_df = similarity_index['data'].iloc[rows[0]][['企鹅的种类', '企鹅栖息的岛屿', '性别'] + SIMILARITY_FEATURES]
+            similar_df.insert(0, '相似距离', distances[0].round(3))
+            with col_form:
+                st.subheader('最相似的已观测企鹅')
+                st.dataframe(similar_df, hide_index=True, use_container_width=True)
 
     # 右侧Logo/结果图展示
     with col_logo:
         if not submitted:
-            st.image('images/rigth_logo.png', width=300)
+            show_image('images/rigth_logo.png', width=300)
+        else:
+            show_image(f'images/predict_result_{predict_result_species}.png', width=300)
+
+# 批量分类页面
+elif page == "批量分类页面":
+    st.header("批量预测企鹅分类")
+    st.markdown("上传与 `penguins-chinese.csv` 结构相同的调查表（岛屿、喙的长度、喙的深度、翅膀的长度、身体质量、性别），一次性预测全部企鹅的物种。")
+
+    rfc_model, output_uniques_map, load_info = get_model()
+    with st.sidebar:
+        review_threshold = st.slider('人工复核置信度阈值', 0.0, 1.0, DEFAULT_REVIEW_THRESHOLD, 0.05)
+    uploaded_file = st.file_uploader('上传CSV文件', type=['csv'])
+    if uploaded_file is not None:
+        add_neighbours = SCIPY_AVAILABLE and st.checkbox('附加最相似的已观测企鹅', value=True)
+        try:
+            survey_df = read_penguin_csv(uploaded_file)
+            result_df = classify_batch(survey_df, rfc_model, output_uniques_map, review_threshold=review_threshold)
+            if add_neighbours:
+                # 同一 KD 树批量查询，测量值缺失的行留空
+                similarity_index = get_similarity_index()
+                measured = survey_df[SIMILARITY_FEATURES].notna().all(axis=1).to_numpy()
+                distances, rows = find_similar_penguins(
+                    similarity_index, survey_df.loc[measured, SIMILARITY_FEATURES], k=1)
+                nearest = similarity_index['data'].iloc[rows[:, 0]]
+                result_df.loc[measured, '最相似观测_物种'] = nearest['企鹅的种类'].to_numpy()
+                result_df.loc[measured, '最相似观测_岛屿'] = nearest['企鹅栖息的岛屿'].to_numpy()
+                result_df.loc[measured, '最相似观测_距离'] = distances[:, 0].round(3)
+        except (KeyError, ValueError) as e:
+            st.error(f'批量分类失败：{e}')
         else:
-            st.image(f'images/predict_result_{predict_result_species}.png', width=300)
+            n_missing = int((result_df['预测物种'] == '数据缺失').sum())
+            n_unknown = int((result_df['预测物种'] == '未知类别').sum())
+            notes = [note for count, note in [(n_missing, f'{n_missing} 行测量值缺失'),
+                                              (n_unknown, f'{n_unknown} 行岛屿/性别取值未知')] if count]
+            st.success(f'已完成 {len(result_df)} 只企鹅的分类' + (f'（{"，".join(notes)}，未预测）' if notes else ''))
+            n_review = int(result_df['需人工复核'].sum())
+            if n_review:
+                st.warning(f'{n_review} 只企鹅的预测置信度低于 {review_threshold:.0%}，已在“需人工复核”列标记')
+            st.dataframe(result_df, use_container_width=True)
+            st.download_button('下载分类结果', data=result_df.to_csv(index=False).encode('utf-8-sig'),
+                               file_name='penguin_predictions.csv', mime='text/csv')